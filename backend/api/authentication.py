@@ -0,0 +1,36 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+
+def get_auth_cache():
+    return caches[settings.AUTH_CACHE_ALIAS]
+
+
+def get_token_cache_key(key):
+    return "auth-token:" + hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_tokens(keys):
+    get_auth_cache().delete_many([get_token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication that keeps ``token -> user`` in a cache.
+
+    Entries are dropped from signals when a token is deleted (logout) or its
+    user is saved or deleted, and expire after ``AUTH_CACHE_TIMEOUT``.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_auth_cache()
+        cache_key = get_token_cache_key(key)
+        user = cache.get(cache_key)
+        if user is not None:
+            token = self.get_model()(key=key, user=user)
+            return user, token
+        user, token = super().authenticate_credentials(key)
+        cache.set(cache_key, user)
+        return user, token
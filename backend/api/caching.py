@@ -0,0 +1,157 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from recipes.models import Tag
+
+
+def get_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def get_invalidated_timeout():
+    """Lifetime of entries that signals invalidate.
+
+    Signals only clear the cache of the process that handled the write, so
+    with a per-process local cache the other workers keep such entries for
+    no longer than ``API_LOCAL_CACHE_TIMEOUT``.
+    """
+    if isinstance(get_cache(), LocMemCache):
+        return min(
+            settings.API_CACHE_TIMEOUT, settings.API_LOCAL_CACHE_TIMEOUT
+        )
+    return settings.API_CACHE_TIMEOUT
+
+
+def get_version(namespace):
+    """Return ``(version, modified_at)`` of a cached namespace"""
+    key = f"version:{namespace}"
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        version = (1, int(time.time()))
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(namespace):
+    version, _ = get_version(namespace)
+    get_cache().set(
+        f"version:{namespace}", (version + 1, int(time.time())), timeout=None
+    )
+
+
+def get_tag_ids_by_slug():
+    version, _ = get_version("tags")
+    key = f"tag-slugs:{version}"
+    cache = get_cache()
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list("slug", "id"))
+        cache.set(key, tag_ids, get_invalidated_timeout())
+    return tag_ids
+
+
+def get_recipe_keys(recipe_ids):
+    """Fragment keys also depend on tag and ingredient data versions"""
+    tags_version, _ = get_version("tags")
+    ingredients_version, _ = get_version("ingredients")
+    return {
+        recipe_id: (
+            f"recipe:{tags_version}:{ingredients_version}:{recipe_id}"
+        )
+        for recipe_id in recipe_ids
+    }
+
+
+def get_recipe_fragments(recipe_ids):
+    keys = get_recipe_keys(recipe_ids)
+    cached = get_cache().get_many(keys.values())
+    return {
+        recipe_id: cached[key]
+        for recipe_id, key in keys.items()
+        if key in cached
+    }
+
+
+def set_recipe_fragments(fragments):
+    keys = get_recipe_keys(fragments)
+    get_cache().set_many(
+        {keys[recipe_id]: data for recipe_id, data in fragments.items()},
+        get_invalidated_timeout(),
+    )
+
+
+def invalidate_recipe_fragments(recipe_ids):
+    get_cache().delete_many(get_recipe_keys(recipe_ids).values())
+
+
+class VersionedCacheMixin:
+    """Cache rendered JSON of list and retrieve until data changes.
+
+    Entries are keyed by the version of ``cache_namespace``, which is bumped
+    from model signals, so stale entries are simply never read again.
+    """
+
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format != "json":
+            return handler(request, *args, **kwargs)
+        version, modified_at = get_version(self.cache_namespace)
+        key = (
+            f"response:{self.cache_namespace}:{version}:"
+            f"{request.get_full_path()}"
+        )
+        cache = get_cache()
+        entry = cache.get(key)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            body = request.accepted_renderer.render(
+                response.data,
+                request.accepted_media_type,
+                self.get_renderer_context(),
+            )
+            entry = (quote_etag(hashlib.md5(body).hexdigest()), body)
+            cache.set(key, entry, get_invalidated_timeout())
+        etag, body = entry
+
+        if self.is_not_modified(request, etag, modified_at):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(modified_at)
+        return response
+
+    @staticmethod
+    def is_not_modified(request, etag, modified_at):
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match is not None:
+            return etag in (
+                value.strip() for value in if_none_match.split(",")
+            ) or if_none_match.strip() == "*"
+        if_modified_since = parse_http_date_safe(
+            request.META.get("HTTP_IF_MODIFIED_SINCE", "")
+        )
+        return if_modified_since is not None and (
+            modified_at <= if_modified_since
+        )
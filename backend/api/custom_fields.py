@@ -1,7 +1,79 @@
+import base64
+import binascii
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework.exceptions import ValidationError
 from rest_framework.serializers import DecimalField
 
+BASE64_CHUNK_SIZE = 64 * 1024
+
 
 class CustomDecimalField(DecimalField):
     def to_representation(self, value):
         value = super().to_representation(value)
         return int(value) if value % 1 == 0 else value
+
+
+class StreamingBase64ImageField(Base64ImageField):
+    """Base64 image field that decodes into a temporary file.
+
+    Only the image header is read here; decoding the pixels, downscaling and
+    re-encoding happen after the recipe is saved, see ``recipes.images``.
+    """
+
+    ALLOWED_TYPES = ("jpeg", "png", "gif", "webp")
+    INVALID_FILE_MESSAGE = "Загрузите корректное изображение."
+    INVALID_TYPE_MESSAGE = "Неподдерживаемый формат изображения."
+    TOO_LARGE_MESSAGE = "Слишком большое изображение."
+
+    def to_internal_value(self, base64_data):
+        if base64_data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(base64_data, str):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        start = base64_data.find(";base64,")
+        start = 0 if start == -1 else start + len(";base64,")
+        file = TemporaryUploadedFile(str(uuid.uuid4()), None, 0, None)
+        try:
+            for chunk in self.iter_chunks(base64_data, start):
+                file.write(base64.b64decode(chunk, validate=True))
+            file.size = file.tell()
+            file.seek(0)
+            image = Image.open(file)
+            extension = image.format.lower()
+            width, height = image.size
+        except (binascii.Error, ValueError, OSError):
+            file.close()
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        if extension not in self.ALLOWED_TYPES:
+            file.close()
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            file.close()
+            raise ValidationError(self.TOO_LARGE_MESSAGE)
+        file.seek(0)
+        file.name = f"{file.name}.{extension}"
+        return file
+
+    @staticmethod
+    def iter_chunks(base64_data, start):
+        """Base64 text without whitespace, in chunks of whole 4-char groups.
+
+        Clients may wrap the encoded image in lines, as MIME does.
+        """
+        rest = ""
+        for position in range(start, len(base64_data), BASE64_CHUNK_SIZE):
+            chunk = rest + "".join(
+                base64_data[position:position + BASE64_CHUNK_SIZE].split()
+            )
+            # every 4 characters decode into 3 bytes on their own
+            end = len(chunk) - len(chunk) % 4
+            rest = chunk[end:]
+            yield chunk[:end]
+        # an incomplete group left over fails to decode
+        if rest:
+            yield rest
@@ -0,0 +1,152 @@
+import heapq
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db.models import Q
+
+from api.caching import get_cache, get_invalidated_timeout
+from recipes.models import Follow, Recipe
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def get_follows_key(user_id):
+    return f"feed-follows:{user_id}"
+
+
+def get_author_recipes_key(author_id):
+    return f"feed-author:{author_id}"
+
+
+def invalidate_follows(user_ids):
+    get_cache().delete_many([get_follows_key(pk) for pk in user_ids])
+
+
+def invalidate_author_recipes(author_ids):
+    get_cache().delete_many(
+        [get_author_recipes_key(pk) for pk in author_ids]
+    )
+
+
+def get_followed_author_ids(user_id):
+    key = get_follows_key(user_id)
+    cache = get_cache()
+    author_ids = cache.get(key)
+    if author_ids is None:
+        author_ids = list(
+            Follow.objects.filter(user_id=user_id).values_list(
+                "author_id", flat=True
+            )
+        )
+        cache.set(key, author_ids, get_invalidated_timeout())
+    return author_ids
+
+
+def get_feed_key(pub_date, pk):
+    """Sort key of a recipe with the date as integer microseconds"""
+    return (pub_date - EPOCH) // MICROSECOND, pk
+
+
+def pack_keys(keys):
+    """Flat ``array`` of keys, much cheaper to pickle than tuples"""
+    return array("q", chain.from_iterable(keys))
+
+
+def find_older(packed, position):
+    """Index of the first key older than ``position`` in packed keys"""
+    low, high = 0, len(packed) // 2
+    while low < high:
+        middle = (low + high) // 2
+        if (packed[2 * middle], packed[2 * middle + 1]) < position:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def iter_keys(packed, start=0):
+    return zip(
+        islice(packed, 2 * start, None, 2),
+        islice(packed, 2 * start + 1, None, 2),
+    )
+
+
+def load_author_recipes(author_ids, limit, before=None):
+    """Newest keys of every author, newest first"""
+    recipes = Recipe.objects.filter(author__in=author_ids)
+    if before is not None:
+        pub_date, pk = before
+        recipes = recipes.filter(
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=pk)
+        )
+    keys = defaultdict(list)
+    for author_id, pub_date, pk in (
+        recipes.limit_per_author(limit)
+        .order_by("-pub_date", "-id")
+        .values_list("author_id", "pub_date", "id")
+    ):
+        keys[author_id].append(get_feed_key(pub_date, pk))
+    return keys
+
+
+def get_author_recipes(author_ids):
+    """Cached ``(complete, packed keys)`` of the newest recipes.
+
+    At most ``FEED_AUTHOR_RECIPES`` keys are kept per author, ``complete``
+    is false when the author has more recipes than that.
+    """
+    cache_keys = {pk: get_author_recipes_key(pk) for pk in author_ids}
+    cache = get_cache()
+    cached = cache.get_many(cache_keys.values())
+    recipes = {
+        author_id: cached[key]
+        for author_id, key in cache_keys.items()
+        if key in cached
+    }
+    missing = [pk for pk in author_ids if pk not in recipes]
+    if missing:
+        limit = settings.FEED_AUTHOR_RECIPES
+        loaded = load_author_recipes(missing, limit)
+        fresh = {}
+        for pk in missing:
+            keys = loaded.get(pk, [])
+            fresh[pk] = (len(keys) < limit, pack_keys(keys))
+        cache.set_many(
+            {cache_keys[pk]: value for pk, value in fresh.items()},
+            get_invalidated_timeout(),
+        )
+        recipes.update(fresh)
+    return recipes
+
+
+def get_feed_ids(user, position, size):
+    """Ids of up to ``size`` feed recipes after ``(pub_date, id)``.
+
+    Every followed author contributes a newest-first stream from the cache
+    and the streams are merged with a heap. Only authors whose cached list
+    is cut off before the page is filled are read from the database.
+    Follows and recipes are invalidated from signals, so with a local cache
+    other workers see changes after ``API_LOCAL_CACHE_TIMEOUT``.
+    """
+    key = position and get_feed_key(*position)
+    streams = []
+    truncated = []
+    for author_id, (complete, packed) in get_author_recipes(
+        get_followed_author_ids(user.pk)
+    ).items():
+        start = find_older(packed, key) if key else 0
+        if len(packed) // 2 - start >= size or complete:
+            streams.append(iter_keys(packed, start))
+        else:
+            truncated.append(author_id)
+    if truncated:
+        streams.extend(
+            load_author_recipes(truncated, size, before=position).values()
+        )
+    return [
+        pk for _, pk in islice(heapq.merge(*streams, reverse=True), size)
+    ]
@@ -1,11 +1,18 @@
 import django_filters as filters
 from django.contrib.auth import get_user_model
+from django_filters.widgets import BooleanWidget
 
+from api.caching import get_tag_ids_by_slug
 from recipes.models import Ingredient, Recipe
 
 
 User = get_user_model()
 
+SCORE_ORDERINGS = {
+    "popular": ("-popular_score", "-id"),
+    "trending": ("-trending_score", "-id"),
+}
+
 
 class IngredientNameFilter(filters.FilterSet):
     name = filters.CharFilter(field_name="name", lookup_expr="istartswith")
@@ -17,28 +24,68 @@ class IngredientNameFilter(filters.FilterSet):
 
 class RecipeFilter(filters.FilterSet):
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
-    tags = filters.AllValuesMultipleFilter(field_name="tags__slug")
+    tags = filters.MultipleChoiceFilter(
+        choices=lambda: [(slug, slug) for slug in get_tag_ids_by_slug()],
+        method="filter_tags",
+    )
 
     is_favorited = filters.BooleanFilter(
-        method="get_is_favorited",
+        method="get_is_favorited", widget=BooleanWidget()
     )
     is_in_shopping_cart = filters.BooleanFilter(
-        method="get_is_in_purchases",
+        method="get_is_in_purchases", widget=BooleanWidget()
+    )
+    search = filters.CharFilter(method="filter_search")
+    # declared last so that it wins over the relevance order of search
+    ordering = filters.ChoiceFilter(
+        choices=[(name, name) for name in SCORE_ORDERINGS],
+        method="filter_ordering",
     )
 
     class Meta:
         model = Recipe
-        fields = ["is_favorited", "is_in_shopping_cart", "author", "tags"]
+        fields = [
+            "is_favorited",
+            "is_in_shopping_cart",
+            "author",
+            "tags",
+            "search",
+            "ordering",
+        ]
+
+    def filter_tags(self, queryset, name, value):
+        # the map may have been reloaded since the choices were validated,
+        # a tag deleted meanwhile simply matches nothing
+        tag_ids = get_tag_ids_by_slug()
+        recipe_ids = Recipe.tags.through.objects.filter(
+            tag_id__in=[tag_ids[slug] for slug in value if slug in tag_ids]
+        ).values("recipe_id")
+        return queryset.filter(pk__in=recipe_ids)
+
+    def filter_search(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        return queryset.search(value)
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*SCORE_ORDERINGS[value])
 
     def get_is_favorited(self, queryset, name, value):
         user = self.request.user
-        if value:
-            return Recipe.objects.filter(favorites__user=user)
-        return Recipe.objects.all()
+        if not value:
+            return queryset
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(pk__in=user.favorites.values("recipe_id"))
 
     def get_is_in_purchases(self, queryset, name, value):
         user = self.request.user
-        if value:
-            return Recipe.objects.filter(recipes_to_purchase__user=user)
-        return Recipe.objects.all()
+        if not value:
+            return queryset
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(
+            pk__in=user.purchases.order_by().values("recipe_id")
+        )
 
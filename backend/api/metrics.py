@@ -0,0 +1,174 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.serializers import BaseSerializer
+
+_local = threading.local()
+
+HISTOGRAMS = (
+    (
+        "request_duration_seconds",
+        "Time spent handling a request",
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    ),
+    (
+        "db_queries",
+        "SQL queries run per request",
+        (0, 1, 2, 3, 5, 8, 13, 21, 34, 55),
+    ),
+    (
+        "db_duration_seconds",
+        "Time spent in SQL queries per request",
+        (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+    ),
+    (
+        "serializer_duration_seconds",
+        "Time spent in serializers per request",
+        (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+    ),
+    (
+        "response_size_bytes",
+        "Size of non-streaming response bodies",
+        (256, 1024, 4096, 16384, 65536, 262144, 1048576),
+    ),
+)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """Per-process histograms keyed by metric name and route labels"""
+
+    prefix = "foodgram_"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {name: buckets for name, _, buckets in HISTOGRAMS}
+        self._histograms = defaultdict(dict)
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self._histograms[name].get(labels)
+            if histogram is None:
+                histogram = self._histograms[name][labels] = Histogram(
+                    self._buckets[name]
+                )
+            histogram.observe(value)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, description, buckets in HISTOGRAMS:
+                metric = self.prefix + name
+                lines.append(f"# HELP {metric} {description}")
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, histogram in sorted(
+                    self._histograms[name].items()
+                ):
+                    label_text = ",".join(
+                        f'{key}="{value}"' for key, value in labels
+                    )
+                    total = 0
+                    for bound, count in zip(
+                        buckets + ("+Inf",), histogram.counts
+                    ):
+                        total += count
+                        lines.append(
+                            f'{metric}_bucket{{{label_text},le="{bound}"}} '
+                            f"{total}"
+                        )
+                    lines.append(
+                        f"{metric}_sum{{{label_text}}} {histogram.sum}"
+                    )
+                    lines.append(f"{metric}_count{{{label_text}}} {total}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    """Costs of the request being handled in the current thread"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0
+        self.serializer_time = 0
+        self._serializer_depth = 0
+
+    @contextmanager
+    def activate(self):
+        _local.metrics = self
+        try:
+            yield self
+        finally:
+            _local.metrics = None
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+def get_current_metrics():
+    return getattr(_local, "metrics", None)
+
+
+def instrument_serializers():
+    """Time the outermost ``serializer.data`` access of each request"""
+    original = BaseSerializer.data
+
+    def data(serializer):
+        metrics = get_current_metrics()
+        if metrics is None or metrics._serializer_depth:
+            return original.fget(serializer)
+        metrics._serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return original.fget(serializer)
+        finally:
+            metrics.serializer_time += time.perf_counter() - started
+            metrics._serializer_depth -= 1
+
+    BaseSerializer.data = property(data)
+
+
+def is_metrics_client(request):
+    """Scraper with the ``METRICS_TOKEN`` bearer token or a staff session"""
+    token = settings.METRICS_TOKEN
+    if token:
+        scheme, _, credentials = request.META.get(
+            "HTTP_AUTHORIZATION", ""
+        ).partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(
+            credentials.strip().encode(), token.encode()
+        ):
+            return True
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def metrics_view(request):
+    if not is_metrics_client(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4"
+    )
@@ -0,0 +1,66 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import RequestMetrics, registry
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware:
+    """Record queries, DB time, serializer time and size of each request.
+
+    The numbers are sent back in a ``Server-Timing`` header, collected into
+    per-route histograms for ``/api/metrics/`` and checked against
+    ``METRICS_QUERY_BUDGET``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        started = time.perf_counter()
+        with metrics.activate(), ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(metrics.record_query)
+                )
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        response["Server-Timing"] = (
+            f'db;dur={metrics.db_time * 1000:.1f};'
+            f'desc="{metrics.queries} queries", '
+            f"serializer;dur={metrics.serializer_time * 1000:.1f}, "
+            f"total;dur={duration * 1000:.1f}"
+        )
+        labels = self.get_labels(request)
+        registry.observe("request_duration_seconds", labels, duration)
+        registry.observe("db_queries", labels, metrics.queries)
+        registry.observe("db_duration_seconds", labels, metrics.db_time)
+        registry.observe(
+            "serializer_duration_seconds", labels, metrics.serializer_time
+        )
+        if not response.streaming:
+            registry.observe(
+                "response_size_bytes", labels, len(response.content)
+            )
+        if metrics.queries > settings.METRICS_QUERY_BUDGET:
+            logger.warning(
+                "%s %s ran %d queries, over the budget of %d",
+                request.method,
+                request.path,
+                metrics.queries,
+                settings.METRICS_QUERY_BUDGET,
+            )
+        return response
+
+    @staticmethod
+    def get_labels(request):
+        match = request.resolver_match
+        view = match.view_name if match is not None else "unmatched"
+        return (("view", view), ("method", request.method))
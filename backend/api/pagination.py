@@ -1,5 +1,263 @@
+import base64
+import json
+from binascii import Error as BinasciiError
+from functools import partial
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework import exceptions
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from api.caching import get_cache
+
+
+def approximate_count(queryset):
+    """Read the planner row estimate for an unfiltered queryset"""
+    connection = connections[queryset.db]
+    if queryset.query.where or connection.vendor != "postgresql":
+        return queryset.count()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return queryset.count()
+    return row[0]
+
+
+def get_count_cache_key(request):
+    """Count cache key built from the normalized filter parameters"""
+    params = sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        if name not in CustomPageNumberPagination.non_filter_params
+        for value in values
+    )
+    return "count:{}:{}:{}".format(
+        request.user.pk or 0, request.path, urlencode(params)
+    )
+
+
+class CountingPaginator(Paginator):
+    """Paginator whose count is approximate or briefly cached"""
+
+    def __init__(self, *args, approximate=False, cache_key=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.approximate = approximate
+        self.cache_key = cache_key
+
+    @cached_property
+    def count(self):
+        if self.approximate:
+            return approximate_count(self.object_list)
+        if self.cache_key is None:
+            return self.object_list.count()
+        return get_cache().get_or_set(
+            self.cache_key,
+            self.object_list.count,
+            settings.PAGINATION_COUNT_CACHE_TIMEOUT,
+        )
 
 
 class CustomPageNumberPagination(PageNumberPagination):
+    """Page number pagination with an opt-in keyset (cursor) mode.
+
+    Passing ``?cursor=`` switches to keyset pagination ordered by the
+    view's ``cursor_ordering``, which is ``None`` for orderings that can't
+    be resumed from a cursor. ``?count=approximate`` reads the row
+    estimate of unfiltered lists instead of running ``COUNT(*)``,
+    ``?count=false`` skips counting, and exact counts are cached for
+    a short time per user and filter parameters.
+    """
+
     page_size_query_param = "limit"
+    max_page_size = settings.MAX_PAGE_SIZE
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    non_filter_params = {"page", "limit", "cursor", "count"}
+    default_cursor_ordering = ("-id",)
+    invalid_cursor_message = "Неверный курсор."
+    unordered_cursor_message = (
+        "Курсор недоступен при сортировке по релевантности, "
+        "используйте page."
+    )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        count_mode = request.query_params.get(self.count_query_param)
+        self.approximate = count_mode == "approximate"
+        self.uncounted = count_mode == "false"
+        self.keyset = self.cursor_query_param in request.query_params
+        if self.keyset:
+            return self.paginate_keyset(queryset, request, view)
+        if self.uncounted:
+            return self.paginate_without_count(queryset, request)
+        self.django_paginator_class = partial(
+            CountingPaginator,
+            approximate=self.approximate,
+            cache_key=get_count_cache_key(request),
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.get_window_response(
+                data, self.get_next_cursor_link(), None
+            )
+        if self.uncounted:
+            return self.get_window_response(
+                data,
+                self.get_next_page_link(),
+                self.get_previous_page_link(),
+            )
+        return super().get_paginated_response(data)
+
+    def get_window_response(self, data, next_link, previous_link):
+        return Response(
+            {
+                "count": self.count,
+                "next": next_link,
+                "previous": previous_link,
+                "results": data,
+            }
+        )
+
+    def paginate_without_count(self, queryset, request):
+        page_size = self.get_page_size(request)
+        try:
+            self.page_number = int(
+                request.query_params.get(self.page_query_param, 1)
+            )
+        except ValueError:
+            self.page_number = 0
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message)
+        offset = (self.page_number - 1) * page_size
+        page = list(queryset[offset:offset + page_size + 1])
+        self.count = None
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        return self.page
+
+    def get_next_page_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.page_query_param,
+            self.page_number + 1,
+        )
+
+    def get_previous_page_link(self):
+        if self.page_number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url, self.page_query_param, self.page_number - 1
+        )
+
+    def get_cursor_ordering(self, view):
+        ordering = getattr(
+            view, "cursor_ordering", self.default_cursor_ordering
+        )
+        if ordering is None:
+            raise exceptions.ValidationError(
+                {self.cursor_query_param: self.unordered_cursor_message}
+            )
+        return ordering
+
+    def paginate_keyset(self, queryset, request, view):
+        self.ordering = self.get_cursor_ordering(view)
+        self.count = approximate_count(queryset) if self.approximate else None
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(
+            queryset.model, request.query_params[self.cursor_query_param]
+        )
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(position))
+        page = list(queryset[: page_size + 1])
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        return self.page
+
+    def paginate_positions(self, model, request, view, get_page):
+        """Keyset pagination over objects found by ``get_page``.
+
+        ``get_page(position, size)`` returns up to ``size`` objects that
+        follow ``position`` in the view's ``cursor_ordering``.
+        """
+        self.request = request
+        self.keyset = True
+        self.ordering = self.get_cursor_ordering(view)
+        self.count = None
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(
+            model, request.query_params.get(self.cursor_query_param)
+        )
+        page = get_page(position, page_size + 1)
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        return self.page
+
+    def get_keyset_filter(self, position):
+        """Rows after ``position`` in a (possibly mixed) field ordering"""
+        fields = [
+            (name.lstrip("-"), "lt" if name.startswith("-") else "gt")
+            for name in self.ordering
+        ]
+        after = Q()
+        for index, (name, lookup) in enumerate(fields):
+            condition = Q(**{f"{name}__{lookup}": position[index]})
+            for previous in range(index):
+                condition &= Q(**{fields[previous][0]: position[previous]})
+            after |= condition
+        # a redundant bound on the leading field lets the index scan
+        # start right at the cursor instead of at the top of the index
+        name, lookup = fields[0]
+        bound = "lte" if lookup == "lt" else "gte"
+        return Q(**{f"{name}__{bound}": position[0]}) & after
+
+    def get_position(self, instance):
+        return [
+            getattr(instance, name.lstrip("-")) for name in self.ordering
+        ]
+
+    def encode_cursor(self, position):
+        payload = json.dumps([str(value) for value in position])
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, model, cursor):
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(name.lstrip("-")).to_python(value)
+                for name, value in zip(self.ordering, values)
+            ]
+        except (BinasciiError, TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_cursor_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.get_position(self.page[-1])),
+        )
@@ -0,0 +1,76 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+def _normalize_amount(amount):
+    return int(amount) if amount % 1 == 0 else float(amount)
+
+
+class _Echo:
+    """File-like object that hands written rows back to the caller"""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Base renderer that can stream a shopping list row by row"""
+
+    charset = "utf-8"
+    filename = "shoplist"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # error payloads produced by the exception handler
+            return json.dumps(data, ensure_ascii=False).encode(self.charset)
+        return "".join(self.stream(data)).encode(self.charset)
+
+    def stream(self, ingredients):
+        raise NotImplementedError
+
+    def get_content_type(self):
+        return f"{self.media_type}; charset={self.charset}"
+
+    def get_filename(self):
+        return f"{self.filename}.{self.format}"
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = "text/plain"
+    format = "txt"
+
+    def stream(self, ingredients):
+        for item in ingredients:
+            yield (
+                f'{item["name"]} - {item["amount"]} '
+                f'{item["measurement_unit"]} \n'
+            )
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = "text/csv"
+    format = "csv"
+
+    def stream(self, ingredients):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(("name", "measurement_unit", "amount"))
+        for item in ingredients:
+            yield writer.writerow(
+                (item["name"], item["measurement_unit"], item["amount"])
+            )
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = "application/json"
+    format = "json"
+
+    def stream(self, ingredients):
+        yield "["
+        separator = ""
+        for item in ingredients:
+            item = dict(item, amount=_normalize_amount(item["amount"]))
+            yield separator + json.dumps(item, ensure_ascii=False)
+            separator = ","
+        yield "]"
@@ -1,23 +1,28 @@
 from rest_framework import serializers, validators
 from djoser.serializers import UserCreateSerializer, UserSerializer
+from collections import defaultdict
 from decimal import Decimal
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import F
-from django.shortcuts import get_object_or_404
-from drf_extra_fields.fields import Base64ImageField
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.db.models import Manager
 from rest_framework.validators import UniqueTogetherValidator
 
-from api.custom_fields import CustomDecimalField
+from api.caching import get_recipe_fragments, set_recipe_fragments
+from api.custom_fields import CustomDecimalField, StreamingBase64ImageField
 from recipes.models import (
     Favorite,
     Ingredient,
     IngredientForRecipe,
     Purchase,
     Recipe,
+    ShoppingListItem,
     Tag,
     Follow
 )
+from recipes.thumbnails import get_thumbnail_urls
 
 
 User = get_user_model()
@@ -55,6 +60,8 @@ class CustomUserSerializer(UserSerializer):
         request = self.context["request"]
         if request.user.is_anonymous or request.user == instance:
             return False
+        if hasattr(instance, "is_subscribed"):
+            return instance.is_subscribed
         return Follow.objects.filter(
             user=request.user, author=instance
         ).exists()
@@ -92,14 +99,8 @@ class FollowSerializer(serializers.ModelSerializer):
 class FollowerSerializer(CustomUserSerializer):
     """Serializer for User model to serialize following information"""
 
-    email = serializers.ReadOnlyField(source="author.email")
-    id = serializers.ReadOnlyField(source="author.id")
-    username = serializers.ReadOnlyField(source="author.username")
-    first_name = serializers.ReadOnlyField(source="author.first_name")
-    last_name = serializers.ReadOnlyField(source="author.last_name")
-    is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -114,24 +115,8 @@ class FollowerSerializer(CustomUserSerializer):
             "recipes_count",
         )
 
-    def get_is_subscribed(self, obj):
-        request = self.context.get("request")
-        if request.user.is_anonymous:
-            return False
-        return Follow.objects.filter(user=obj.user, author=obj.author).exists()
-
     def get_recipes(self, obj):
-        request = self.context.get("request")
-        limit = request.GET.get("recipes_limit")
-        queryset = Recipe.objects.filter(author=obj.author)
-        if limit is not None:
-            queryset = Recipe.objects.filter(author=obj.author)[: int(limit)]
-
-        return BriefRecipeSerializer(queryset, many=True).data
-
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
-
+        return BriefRecipeSerializer(obj.recipes_preview, many=True).data
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -141,9 +126,7 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 
 class AddIngredientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        source="ingredient", queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField(source="ingredient_id")
     amount = serializers.IntegerField()
 
     class Meta:
@@ -158,9 +141,23 @@ class TagSerializer(serializers.ModelSerializer):
 
 
 class BriefRecipeSerializer(serializers.ModelSerializer):
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "thumbnails", "cooking_time")
+
+    def get_thumbnails(self, obj):
+        if not obj.image_ready:
+            return {}
+        urls = get_thumbnail_urls(obj.thumbnails)
+        request = self.context.get("request")
+        if request is None:
+            return urls
+        return {
+            name: request.build_absolute_uri(url)
+            for name, url in urls.items()
+        }
 
 
 class IngredientForRecipeSerializer(serializers.ModelSerializer):
@@ -175,6 +172,61 @@ class IngredientForRecipeSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit", "amount")
 
 
+class RecipeListSerializer(serializers.ListSerializer):
+    """Render recipes from cached user-independent fragments"""
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        self.set_user_flags(recipes)
+        fragments = get_recipe_fragments([recipe.id for recipe in recipes])
+        missing = [
+            recipe.id for recipe in recipes if recipe.id not in fragments
+        ]
+        if missing:
+            built = {
+                recipe.id: self.child.build_fragment(recipe)
+                for recipe in Recipe.objects.with_user_flags(AnonymousUser())
+                .with_relations()
+                .filter(id__in=missing)
+            }
+            set_recipe_fragments(built)
+            fragments.update(built)
+        return [
+            self.child.overlay(fragments[recipe.id], recipe)
+            for recipe in recipes
+        ]
+
+    def set_user_flags(self, recipes):
+        """Look up per-user flags of a whole page with one query each"""
+        user = self.context["request"].user
+        if user.is_anonymous or not recipes:
+            return
+        if hasattr(recipes[0], "author_is_subscribed"):
+            return
+        recipe_ids = [recipe.id for recipe in recipes]
+        favorited = set(
+            user.favorites.filter(recipe_id__in=recipe_ids).values_list(
+                "recipe_id", flat=True
+            )
+        )
+        in_shopping_cart = set(
+            user.purchases.filter(recipe_id__in=recipe_ids)
+            .order_by()
+            .values_list("recipe_id", flat=True)
+        )
+        subscribed = set(
+            user.follower.filter(
+                author_id__in={recipe.author_id for recipe in recipes}
+            )
+            .order_by()
+            .values_list("author_id", flat=True)
+        )
+        for recipe in recipes:
+            recipe.is_favorited = recipe.id in favorited
+            recipe.is_in_shopping_cart = recipe.id in in_shopping_cart
+            recipe.author_is_subscribed = recipe.author_id in subscribed
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     author = CustomUserSerializer(
@@ -187,6 +239,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     cooking_time = CustomDecimalField(max_digits=4, decimal_places=1)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -199,14 +252,18 @@ class RecipeSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "thumbnails",
             "text",
             "cooking_time",
         )
+        list_serializer_class = RecipeListSerializer
 
     def get_is_favorited(self, obj):
         request = self.context.get("request")
         if request.user.is_anonymous:
             return False
+        if hasattr(obj, "is_favorited"):
+            return obj.is_favorited
         return Favorite.objects.filter(
             recipe=obj,
             user=request.user,
@@ -216,8 +273,55 @@ class RecipeSerializer(serializers.ModelSerializer):
         request = self.context.get("request")
         if request.user.is_anonymous:
             return False
+        if hasattr(obj, "is_in_shopping_cart"):
+            return obj.is_in_shopping_cart
         return Purchase.objects.filter(user=request.user, recipe=obj).exists()
 
+    def get_thumbnails(self, obj):
+        """Relative URLs, made absolute per request in ``overlay``"""
+        if not obj.image_ready:
+            return {}
+        return get_thumbnail_urls(obj.thumbnails)
+
+    def to_representation(self, instance):
+        if hasattr(instance, "author_is_subscribed"):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
+    def build_fragment(self, instance):
+        """Representation shared by all users, with a relative image URL"""
+        data = self.to_representation(instance)
+        data["image"] = instance.image.url if instance.image else None
+        return data
+
+    def overlay(self, fragment, instance):
+        """Fill in the fields of a fragment that depend on the user"""
+        request = self.context.get("request")
+        data = fragment.copy()
+        data["author"] = fragment["author"].copy()
+        if data["image"]:
+            data["image"] = request.build_absolute_uri(data["image"])
+        data["thumbnails"] = {
+            name: request.build_absolute_uri(url)
+            for name, url in fragment.get("thumbnails", {}).items()
+        }
+        data["is_favorited"] = self.get_is_favorited(instance)
+        data["is_in_shopping_cart"] = self.get_is_in_shopping_cart(instance)
+        data["author"]["is_subscribed"] = self.get_author_is_subscribed(
+            instance
+        )
+        return data
+
+    def get_author_is_subscribed(self, obj):
+        user = self.context.get("request").user
+        if user.is_anonymous or user.id == obj.author_id:
+            return False
+        if hasattr(obj, "author_is_subscribed"):
+            return obj.author_is_subscribed
+        return Follow.objects.filter(
+            user=user, author_id=obj.author_id
+        ).exists()
+
 
 class AddRecipeSerializer(serializers.ModelSerializer):
     tags = serializers.PrimaryKeyRelatedField(
@@ -225,7 +329,7 @@ class AddRecipeSerializer(serializers.ModelSerializer):
     )
     ingredients = AddIngredientSerializer(many=True)
     author = CustomUserSerializer(read_only=True)
-    image = Base64ImageField(max_length=None, use_url=True)
+    image = StreamingBase64ImageField(max_length=None, use_url=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -259,45 +363,104 @@ class AddRecipeSerializer(serializers.ModelSerializer):
             return False
         return Purchase.objects.filter(user=request.user, recipe=obj).exists()
 
-    def create_ingredients(self, recipe, ingredients):
+    def validate_ingredients(self, ingredients):
+        ids = {ingredient["ingredient_id"] for ingredient in ingredients}
+        missing = ids - Ingredient.objects.in_bulk(ids).keys()
+        if missing:
+            raise serializers.ValidationError(
+                f"Ингредиенты не найдены: {sorted(missing)}"
+            )
+        return ingredients
+
+    @staticmethod
+    def merge_ingredients(ingredients):
+        amounts = defaultdict(int)
         for ingredient in ingredients:
-            ingr_instance = get_object_or_404(
-                Ingredient, id=ingredient["ingredient"].id
+            amounts[ingredient["ingredient_id"]] += ingredient["amount"]
+        return amounts
+
+    def create_ingredients(self, recipe, ingredients):
+        IngredientForRecipe.objects.bulk_create(
+            IngredientForRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
             )
-            amount = ingredient["amount"]
-            if IngredientForRecipe.objects.filter(
-                recipe=recipe, ingredient=ingr_instance
-            ).exists():
-                amount += F("amount")
-            IngredientForRecipe.objects.update_or_create(
-                {"amount": amount},
-                recipe=recipe,
-                ingredient=ingr_instance,
+            for ingredient_id, amount in self.merge_ingredients(
+                ingredients
+            ).items()
+        )
+
+    def update_ingredients(self, recipe, ingredients):
+        new_amounts = self.merge_ingredients(ingredients)
+        existing = {
+            item.ingredient_id: item
+            for item in recipe.ingredientsforrecipe.all()
+        }
+        old_amounts = {
+            ingredient_id: item.amount
+            for ingredient_id, item in existing.items()
+        }
+        to_update = []
+        for ingredient_id, item in existing.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != item.amount:
+                item.amount = amount
+                to_update.append(item)
+        IngredientForRecipe.objects.filter(
+            id__in=[
+                item.id
+                for ingredient_id, item in existing.items()
+                if ingredient_id not in new_amounts
+            ]
+        ).delete()
+        IngredientForRecipe.objects.bulk_update(to_update, ["amount"])
+        IngredientForRecipe.objects.bulk_create(
+            IngredientForRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
             )
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in existing
+        )
+        ShoppingListItem.objects.update_recipe(
+            recipe.id, old_amounts, new_amounts
+        )
+
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get("image")
+            if image is not None:
+                # the upload is moved into storage, drop its temp handle
+                image.close()
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop("tags")
         ingredients = validated_data.pop("ingredients")
         author = self.context.get("request").user
-        recipe = Recipe.objects.create(author=author, **validated_data)
+        recipe = Recipe.objects.create(
+            author=author, image_ready=False, **validated_data
+        )
         recipe.tags.set(tags)
         self.create_ingredients(recipe, ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         if "tags" in self.initial_data:
             tags = validated_data.pop("tags")
             instance.tags.set(tags)
         if "ingredients" in self.initial_data:
             ingredients = validated_data.pop("ingredients")
-            instance.ingredients.clear()
-            self.create_ingredients(instance, ingredients)
+            self.update_ingredients(instance, ingredients)
         instance.name = validated_data.get("name", instance.name)
         instance.text = validated_data.get("text", instance.text)
         instance.cooking_time = validated_data.get(
             "cooking_time", instance.cooking_time
         )
-        instance.image = validated_data.get("image", instance.image)
+        if "image" in validated_data:
+            instance.image = validated_data["image"]
+            instance.image_ready = False
         instance.save()
         return instance
 
@@ -308,10 +471,7 @@ class AddRecipeSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {"ingredients": ("Не выбран ни один ингредиент")}
             )
-        if len(ingredients) > len(set(k.get("id") for k in ingredients)):
-            raise serializers.ValidationError(
-                {"ingredients": ("Есть задвоения в выбранных ингредиентах")}
-            )
+        # repeated ingredients are summed up by merge_ingredients
         for ingredient in ingredients:
             if int(ingredient["amount"]) <= 0:
                 raise serializers.ValidationError(
@@ -328,10 +488,16 @@ class AddRecipeSerializer(serializers.ModelSerializer):
         return data
 
     def to_representation(self, instance):
+        request = self.context.get("request")
+        instance = (
+            Recipe.objects.with_user_flags(request.user)
+            .with_relations()
+            .get(pk=instance.pk)
+        )
         recipes = RecipeSerializer(
-            instance, context={"request": self.context.get("request")}
+            [instance], many=True, context={"request": request}
         )
-        return recipes.data
+        return recipes.data[0]
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
@@ -358,6 +524,14 @@ class FavoriteSerializer(serializers.ModelSerializer):
         return BriefRecipeSerializer(instance.recipe, context=context).data
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_RECIPES,
+    )
+
+
 class PurchaseSerializer(serializers.ModelSerializer):
     class Meta:
         model = Purchase
@@ -0,0 +1,128 @@
+from django.contrib.auth import get_user_model
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.images import image_processed
+from recipes.models import Follow, Ingredient, IngredientForRecipe, Recipe, Tag
+from recipes.signals import rows_loaded
+
+from .authentication import invalidate_tokens
+from .caching import bump_version, invalidate_recipe_fragments
+from .feed import invalidate_author_recipes, invalidate_follows
+
+User = get_user_model()
+
+
+def invalidate_recipes_on_commit(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    transaction.on_commit(lambda: invalidate_recipe_fragments(recipe_ids))
+
+
+@receiver(request_started)
+def check_persistent_connections(sender, **kwargs):
+    """Drop persistent connections the database has closed meanwhile"""
+    for connection in connections.all():
+        if (
+            connection.connection is not None
+            and connection.settings_dict.get("CONN_HEALTH_CHECKS")
+            and not connection.is_usable()
+        ):
+            connection.close()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(rows_loaded, sender=Tag)
+def invalidate_tags_cache(sender, **kwargs):
+    bump_version("tags")
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(rows_loaded, sender=Ingredient)
+def invalidate_ingredients_cache(sender, **kwargs):
+    bump_version("ingredients")
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_cache(sender, instance, **kwargs):
+    invalidate_recipes_on_commit([instance.id])
+
+
+@receiver(image_processed, sender=Recipe)
+def invalidate_processed_image_cache(sender, recipe_id, **kwargs):
+    invalidate_recipe_fragments([recipe_id])
+
+
+@receiver(post_save, sender=IngredientForRecipe)
+@receiver(post_delete, sender=IngredientForRecipe)
+def invalidate_recipe_ingredients_cache(sender, instance, **kwargs):
+    invalidate_recipes_on_commit([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags_cache(sender, instance, action, reverse, pk_set,
+                                 **kwargs):
+    if reverse and action == "pre_clear":
+        invalidate_recipes_on_commit(
+            instance.recipes.values_list("id", flat=True)
+        )
+    elif action in ("post_add", "post_remove", "post_clear"):
+        recipe_ids = (pk_set or []) if reverse else [instance.id]
+        invalidate_recipes_on_commit(recipe_ids)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_recipes_cache(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_recipes_on_commit(
+            instance.written_recipes.values_list("id", flat=True)
+        )
+
+
+def invalidate_author_feeds_on_commit(author_ids):
+    author_ids = list(author_ids)
+    transaction.on_commit(lambda: invalidate_author_recipes(author_ids))
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_new_recipe_feed_cache(sender, instance, created, **kwargs):
+    if created:
+        invalidate_author_feeds_on_commit([instance.author_id])
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_deleted_recipe_feed_cache(sender, instance, **kwargs):
+    invalidate_author_feeds_on_commit([instance.author_id])
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follows_cache(sender, instance, **kwargs):
+    user_ids = [instance.user_id]
+    transaction.on_commit(lambda: invalidate_follows(user_ids))
+
+
+def invalidate_tokens_on_commit(keys):
+    keys = list(keys)
+    transaction.on_commit(lambda: invalidate_tokens(keys))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_tokens_on_commit([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    """Password changes, deactivation and profile edits reach the cache"""
+    if not created:
+        invalidate_tokens_on_commit(
+            Token.objects.filter(user_id=instance.pk).values_list(
+                "key", flat=True
+            )
+        )
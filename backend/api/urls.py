@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .metrics import metrics_view
+
 from .views import (
     CustomUserViewSet,
     IngredientViewSet,
@@ -20,3 +23,5 @@ urlpatterns = [
     path("auth/", include("djoser.urls.authtoken")),
     path("", include(router.urls)),
 ]
+if settings.METRICS_ENABLED:
+    urlpatterns.insert(0, path("metrics/", metrics_view, name="metrics"))
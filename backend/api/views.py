@@ -1,17 +1,33 @@
 from rest_framework import status, viewsets
 from rest_framework.permissions import AllowAny
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http.response import HttpResponse
+from django.db.models import (
+    BooleanField,
+    F,
+    Prefetch,
+    Value,
+    prefetch_related_objects,
+)
+from django.http.response import StreamingHttpResponse
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 
-from api.filters import RecipeFilter
+from api.caching import VersionedCacheMixin
+from api.feed import get_feed_ids
+from api.filters import SCORE_ORDERINGS, RecipeFilter
 from api.permissions import IsAuthorOrAdminOrReadOnly
+from api.renderers import (
+    ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer,
+    ShoppingListTextRenderer,
+)
 from api.serializers import (
     AddRecipeSerializer,
     FavoriteSerializer,
@@ -19,14 +35,17 @@ from api.serializers import (
     FollowSerializer,
     TagSerializer,
     PurchaseSerializer,
+    RecipeIdsSerializer,
     RecipeSerializer,
 )
 
+from recipes.autocomplete import ingredient_index
 from recipes.models import (Tag,
+                            Favorite,
                             Ingredient,
-                            IngredientForRecipe,
                             Purchase,
                             Recipe,
+                            ShoppingListItem,
                             Follow)
 
 from api.filters import IngredientNameFilter
@@ -37,45 +56,30 @@ from api.serializers import IngredientSerializer
 User = get_user_model()
 
 
-class CustomUserViewSet(UserViewSet):
-    @action(detail=True, permission_classes=[IsAuthenticated], methods=["get"])
-    def subscribe(self, request, id=None):
-        user = request.user
-        author = get_object_or_404(User, id=id)
-
-        data = {
-            "user": user.id,
-            "author": author.id,
-        }
-        serializer = FollowSerializer(data=data, context={"request": request})
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+def get_query_int(request, name, default=None):
+    """Read a non-negative integer query parameter"""
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise ValidationError({name: "Ожидается неотрицательное целое число"})
+    return value
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    @subscribe.mapping.delete
-    def delete_subscribe(self, request, id=None):
-        user = request.user
-        author = get_object_or_404(User, id=id)
-        subscribe = get_object_or_404(Follow, user=user, author=author)
-        subscribe.delete()
-
-        return Response(status=status.HTTP_204_NO_CONTENT)
-
-    @action(
-        detail=False, permission_classes=[IsAuthenticated], methods=["get"]
-    )
-    def subscriptions(self, request):
-        user = request.user
-        queryset = Follow.objects.filter(user=user)
-        pages = self.paginate_queryset(queryset)
-        serializer = FollowerSerializer(
-            pages, many=True, context={"request": request}
-        )
-        return self.get_paginated_response(serializer.data)
+def get_query_ids(request, name):
+    """Read a repeated query parameter of object ids"""
+    try:
+        return {int(value) for value in request.query_params.getlist(name)}
+    except ValueError:
+        raise ValidationError({name: "Ожидается список целых чисел"})
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
+    cache_namespace = "tags"
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     permission_classes = (AllowAny,)
@@ -88,6 +92,24 @@ class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
     filterset_class = RecipeFilter
 
+    @property
+    def cursor_ordering(self):
+        """Keyset ordering, ``None`` while relevance ranks the results"""
+        params = self.request.query_params
+        if self.action == "by_ingredients":
+            return None
+        if self.action == "list":
+            ordering = params.get("ordering")
+            if ordering in SCORE_ORDERINGS:
+                return SCORE_ORDERINGS[ordering]
+            if params.get("search", "").strip():
+                return None
+        return ("-pub_date", "-id")
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer([self.get_object()], many=True)
+        return Response(serializer.data[0])
+
     def get_serializer_class(self):
         if self.request.method in ("POST", "PUT", "PATCH"):
             return AddRecipeSerializer
@@ -148,47 +170,143 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False, permission_classes=[IsAuthenticated])
-    def download_shopping_cart(self, request):
-        user = request.user
-        recipes = user.purchases.values_list("recipe", flat=True)
-        ingredients = IngredientForRecipe.objects.filter(
-            recipe__in=recipes
-        ).values_list(
-            "ingredient__name", "ingredient__measurement_unit", "amount"
+    def change_recipes(self, request, queryset):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data["recipes"]
+        if request.method == "POST":
+            statuses = queryset.add_recipes(request.user, recipe_ids)
+        else:
+            statuses = queryset.remove_recipes(request.user, recipe_ids)
+        return Response(
+            [{"id": pk, "status": value} for pk, value in statuses.items()]
+        )
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        methods=["post", "delete"],
+        url_path="favorite/batch",
+    )
+    def favorite_batch(self, request):
+        """Add or remove several favorite recipes at once"""
+        return self.change_recipes(request, Favorite.objects)
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        methods=["post", "delete"],
+        url_path="shopping_cart/batch",
+    )
+    def shopping_cart_batch(self, request):
+        """Add or remove several recipes of the shopping cart at once"""
+        return self.change_recipes(request, Purchase.objects)
+
+    @action(
+        detail=False, permission_classes=[IsAuthenticated], methods=["get"]
+    )
+    def feed(self, request):
+        """Recipes of followed authors, newest first"""
+
+        def get_page(position, size):
+            ids = get_feed_ids(request.user, position, size)
+            recipes = Recipe.objects.in_bulk(ids)
+            return [recipes[pk] for pk in ids if pk in recipes]
+
+        page = self.paginator.paginate_positions(
+            Recipe, request, self, get_page
         )
-        data = {}
-        for ingredient in ingredients:
-            name, measurement_unit, amount = ingredient
-            if name not in data:
-                data[name] = {
-                    "measurement_unit": measurement_unit,
-                    "amount": amount,
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=["get"])
+    def by_ingredients(self, request):
+        """Recipes ranked by how much of them the given ingredients cover"""
+        ingredient_ids = get_query_ids(request, "ingredients")
+        if not ingredient_ids:
+            raise ValidationError(
+                {"ingredients": "Не выбран ни один ингредиент"}
+            )
+        limit = settings.RECIPE_COVERAGE_MAX_INGREDIENTS
+        if len(ingredient_ids) > limit:
+            raise ValidationError(
+                {
+                    "ingredients": (
+                        f"Можно выбрать не больше {limit} ингредиентов"
+                    )
                 }
-            else:
-                data[name]["amount"] += amount
-
-        shopping_list = []
-        for item in data:
-            shopping_list.append(
-                f'{item} - {data[item]["amount"]} '
-                f'{data[item]["measurement_unit"]} \n'
             )
-        response = HttpResponse(shopping_list, "Content-Type: text/plain")
-        response["Content-Disposition"] = 'attachment; filename="shoplist.txt"'
+        queryset = self.filter_queryset(
+            self.get_queryset()
+        ).with_ingredient_coverage(ingredient_ids)
+        max_missing = get_query_int(request, "max_missing")
+        if max_missing is not None:
+            queryset = queryset.filter(missing_count__lte=max_missing)
+        page = self.paginate_queryset(queryset)
+        data = self.get_serializer(page, many=True).data
+        for item, recipe in zip(data, page):
+            matched = recipe.ingredients_count - recipe.missing_count
+            item["matched_count"] = matched
+            item["missing_count"] = recipe.missing_count
+            item["coverage"] = round(matched / recipe.ingredients_count, 3)
+        return self.get_paginated_response(data)
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        renderer_classes=[
+            ShoppingListTextRenderer,
+            ShoppingListCSVRenderer,
+            ShoppingListJSONRenderer,
+        ],
+    )
+    def download_shopping_cart(self, request):
+        ingredients = (
+            ShoppingListItem.objects.filter(user=request.user)
+            .values(
+                name=F("ingredient__name"),
+                measurement_unit=F("ingredient__measurement_unit"),
+                amount=F("total_amount"),
+            )
+            .order_by("name", "measurement_unit")
+        )
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=renderer.get_content_type(),
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{renderer.get_filename()}"'
+        )
 
         return response
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(VersionedCacheMixin, viewsets.ModelViewSet):
+    cache_namespace = "ingredients"
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
     pagination_class = None
     permission_classes = (AllowAny,)
     filterset_class = IngredientNameFilter
+    autocomplete_params = {"name", "limit"}
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        autocomplete = (
+            "name" in params and params.keys() <= self.autocomplete_params
+        )
+        if not autocomplete:
+            return super().list(request, *args, **kwargs)
+        limit = get_query_int(
+            request, "limit", settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        )
+        return Response(ingredient_index.search(params["name"], limit))
 
 
 class CustomUserViewSet(UserViewSet):
+    cursor_ordering = ("id",)
+
     @action(detail=True, permission_classes=[IsAuthenticated], methods=["get"])
     def subscribe(self, request, id=None):
         user = request.user
@@ -218,8 +336,22 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         user = request.user
-        queryset = Follow.objects.filter(user=user)
+        recipes_limit = get_query_int(request, "recipes_limit")
+        queryset = (
+            User.objects.filter(following__user=user)
+            .annotate(is_subscribed=Value(True, output_field=BooleanField()))
+            .order_by("id")
+        )
         pages = self.paginate_queryset(queryset)
+        recipes = Recipe.objects.filter(author__in=pages)
+        if recipes_limit is not None:
+            recipes = recipes.limit_per_author(recipes_limit)
+        prefetch_related_objects(
+            pages,
+            Prefetch(
+                "written_recipes", queryset=recipes, to_attr="recipes_preview"
+            ),
+        )
         serializer = FollowerSerializer(
             pages, many=True, context={"request": request}
         )
@@ -1,7 +1,25 @@
 import os
 
-from django.core.asgi import get_asgi_application
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+
+def close_response(wsgi_application):
+    """Close responses like a WSGI server, so request_finished is sent"""
+
+    def application(environ, start_response):
+        response = wsgi_application(environ, start_response)
+        try:
+            yield from response
+        finally:
+            response.close()
+
+    return application
+
+
+# Django 2.2 has no native ASGI handler: views run in the thread pool of the
+# event loop (sized by ASGI_THREADS), while uvicorn keeps slow clients and
+# idle keep-alive connections off those threads.
+application = WsgiToAsgi(close_response(get_wsgi_application()))
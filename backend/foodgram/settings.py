@@ -19,14 +19,15 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "django_filters",
     "sorl.thumbnail",
     "rest_framework",
     "rest_framework.authtoken",
     "djoser",
-    "recipes",
+    "recipes.apps.RecipesConfig",
     "colorfield",
-    "api",
+    "api.apps.ApiConfig",
 ]
 
 MIDDLEWARE = [
@@ -39,6 +40,13 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", default="false") == "true"
+METRICS_QUERY_BUDGET = int(os.getenv("METRICS_QUERY_BUDGET", default=20))
+# bearer token of the Prometheus scraper, staff sessions are let in too
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", default="")
+if METRICS_ENABLED:
+    MIDDLEWARE.insert(0, "api.middleware.MetricsMiddleware")
+
 ROOT_URLCONF = "foodgram.urls"
 
 TEMPLATES = [
@@ -65,10 +73,50 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', ),
-        'PORT': os.getenv('DB_PORT', default=5432)
+        'PORT': os.getenv('DB_PORT', default=5432),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        # same key as in Django 4.1+, checked in api.signals until then
+        'CONN_HEALTH_CHECKS': (
+            os.getenv('DB_CONN_HEALTH_CHECKS', default='true') == 'true'
+        ),
+        # pgbouncer in transaction pooling mode can't keep named cursors
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_PGBOUNCER') == 'true',
     }
 }
 
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND",
+            default="django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", default="foodgram"),
+        "OPTIONS": {
+            # the feed keeps one entry per author
+            "MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", default=10000)),
+        },
+    },
+    "auth": {
+        "BACKEND": os.getenv(
+            "AUTH_CACHE_BACKEND",
+            default="django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("AUTH_CACHE_LOCATION", default="auth"),
+        "TIMEOUT": int(os.getenv("AUTH_CACHE_TIMEOUT", default=60)),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(
+                os.getenv("AUTH_CACHE_MAX_ENTRIES", default=10000)
+            ),
+        },
+    },
+}
+API_CACHE_ALIAS = "default"
+API_CACHE_TIMEOUT = int(os.getenv("API_CACHE_TIMEOUT", default=600))
+API_LOCAL_CACHE_TIMEOUT = int(
+    os.getenv("API_LOCAL_CACHE_TIMEOUT", default=5)
+)
+AUTH_CACHE_ALIAS = "auth"
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",  # noqa
@@ -101,12 +149,50 @@ EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 EMAIL_FILE_PATH = BASE_DIR / "sent_emails"
 
 ITEMS_PER_PAGE = 6
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", default=100))
+FEED_AUTHOR_RECIPES = int(os.getenv("FEED_AUTHOR_RECIPES", default=50))
+PAGINATION_COUNT_CACHE_TIMEOUT = int(
+    os.getenv("PAGINATION_COUNT_CACHE_TIMEOUT", default=30)
+)
+INGREDIENT_AUTOCOMPLETE_LIMIT = int(
+    os.getenv("INGREDIENT_AUTOCOMPLETE_LIMIT", default=20)
+)
+INGREDIENT_INDEX_TTL = int(os.getenv("INGREDIENT_INDEX_TTL", default=300))
+RECIPE_SEARCH_CONFIG = "russian"
+RECIPE_POPULAR_HALF_LIFE_DAYS = float(
+    os.getenv("RECIPE_POPULAR_HALF_LIFE_DAYS", default=90)
+)
+RECIPE_TRENDING_HALF_LIFE_DAYS = float(
+    os.getenv("RECIPE_TRENDING_HALF_LIFE_DAYS", default=3)
+)
+BATCH_MAX_RECIPES = int(os.getenv("BATCH_MAX_RECIPES", default=100))
+RECIPE_COVERAGE_MAX_INGREDIENTS = int(
+    os.getenv("RECIPE_COVERAGE_MAX_INGREDIENTS", default=50)
+)
+RECIPE_THUMBNAIL_FORMAT = os.getenv("RECIPE_THUMBNAIL_FORMAT", default="WEBP")
+RECIPE_THUMBNAILS = {
+    "brief": ("200x200", {"crop": "center", "quality": 80}),
+    "card": ("600x400", {"crop": "center", "quality": 80}),
+    "detail": ("1200", {"upscale": False, "quality": 85}),
+}
+RECIPE_IMAGE_MAX_SIZE = int(os.getenv("RECIPE_IMAGE_MAX_SIZE", default=2048))
+RECIPE_IMAGE_MAX_BYTES = int(
+    os.getenv("RECIPE_IMAGE_MAX_BYTES", default=2_097_152)
+)
+RECIPE_IMAGE_MAX_PIXELS = 50_000_000
+RECIPE_IMAGE_QUALITY = 85
+IMAGE_PROCESSING_WORKERS = int(
+    os.getenv("IMAGE_PROCESSING_WORKERS", default=2)
+)
+IMAGE_PROCESSING_QUEUE_SIZE = int(
+    os.getenv("IMAGE_PROCESSING_QUEUE_SIZE", default=32)
+)
 
 
 REST_FRAMEWORK = {
     "COERCE_DECIMAL_TO_STRING": False,
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
     ],
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend"
@@ -132,6 +218,8 @@ DJOSER = {
 
 MEDIA_URL = "/backend_media/"
 MEDIA_ROOT = BASE_DIR / "backend_media"
+# large uploads are moved from a 0600 temporary file, nginx must read them
+FILE_UPLOAD_PERMISSIONS = 0o644
 STATIC_URL = "/backend_static/"
 STATIC_ROOT = BASE_DIR / "backend_static/"
 
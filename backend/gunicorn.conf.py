@@ -0,0 +1,11 @@
+import os
+
+# "wsgi" runs sync workers, "asgi" runs uvicorn workers
+SERVER_INTERFACE = os.getenv("SERVER_INTERFACE", default="wsgi")
+
+bind = "0.0.0.0:8000"
+if SERVER_INTERFACE == "asgi":
+    wsgi_app = "foodgram.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "foodgram.wsgi:application"
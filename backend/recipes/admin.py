@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db import connections
 
 from .models import (
     Favorite,
@@ -7,6 +8,7 @@ from .models import (
     IngredientForRecipe,
     Purchase,
     Recipe,
+    ShoppingListItem,
     Tag,
 )
 
@@ -31,13 +33,40 @@ class RecipeAdmin(admin.ModelAdmin):
         "is_favorited",
         "cooking_time",
     )
-    search_fields = ("name", "author", "text")
+    search_fields = ("name", "author__username", "text")
     list_filter = ("name", "author", "ingredients", "tags")
     empty_value_display = "-пусто-"
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or connections[queryset.db].vendor != "postgresql":
+            return super().get_search_results(request, queryset, search_term)
+        # the stored search vector instead of ILIKE scans over the text
+        return queryset.search(search_term), False
+
     @staticmethod
     def is_favorited(obj):
-        return obj.favorites.count()
+        return obj.favorites_count
+
+    def save_model(self, request, obj, form, change):
+        if "image" in form.changed_data:
+            obj.image_ready = False
+        super().save_model(request, obj, form, change)
+
+    @staticmethod
+    def get_amounts(recipe):
+        return dict(
+            IngredientForRecipe.objects.filter(recipe=recipe).values_list(
+                "ingredient_id", "amount"
+            )
+        )
+
+    def save_related(self, request, form, formsets, change):
+        # inline ingredient edits must reach the carts holding the recipe
+        old_amounts = self.get_amounts(form.instance) if change else {}
+        super().save_related(request, form, formsets, change)
+        ShoppingListItem.objects.update_recipe(
+            form.instance.pk, old_amounts, self.get_amounts(form.instance)
+        )
 
 
 class TagAdmin(admin.ModelAdmin):
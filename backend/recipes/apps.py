@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import signals  # noqa: F401
+        from .backfill import backfill_counters, backfill_shopping_lists
+        from .search import create_search_indexes
+
+        post_migrate.connect(create_search_indexes, sender=self)
+        post_migrate.connect(backfill_counters, sender=self)
+        post_migrate.connect(backfill_shopping_lists, sender=self)
@@ -0,0 +1,70 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+
+from .models import Ingredient
+
+MAX_CHAR = chr(0x10FFFF)
+
+
+class IngredientIndex:
+    """In-memory case-folded index of ingredient names.
+
+    Names are kept in a sorted array, so prefix matches are found with
+    bisect and substring matches with a linear scan over the keys only.
+    The index is rebuilt lazily after invalidation or once ``ttl`` seconds
+    have passed, which bounds staleness across worker processes.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._keys = None
+        self._items = None
+        self._built_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._keys = None
+            self._items = None
+
+    def _build(self):
+        items = sorted(
+            Ingredient.objects.values("id", "name", "measurement_unit"),
+            key=lambda item: (item["name"].casefold(), item["id"]),
+        )
+        return [item["name"].casefold() for item in items], items
+
+    def _get(self):
+        ttl = self.ttl
+        if ttl is None:
+            ttl = settings.INGREDIENT_INDEX_TTL
+        with self._lock:
+            expired = time.monotonic() - self._built_at > ttl
+            if self._keys is None or expired:
+                self._keys, self._items = self._build()
+                self._built_at = time.monotonic()
+            return self._keys, self._items
+
+    def search(self, query, limit=None):
+        """Return prefix matches first, then substring matches"""
+        keys, items = self._get()
+        query = query.casefold()
+        start = bisect_left(keys, query)
+        end = bisect_right(keys, query + MAX_CHAR, lo=start)
+        results = items[start:end]
+        if limit is not None and len(results) >= limit:
+            return results[:limit]
+        if query:
+            for position, key in enumerate(keys):
+                if start <= position < end or query not in key:
+                    continue
+                results.append(items[position])
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,73 @@
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Favorite, Follow, Purchase, Recipe, ShoppingListItem
+
+User = get_user_model()
+
+COUNTERS = (
+    (Recipe, "favorites_count", Favorite, "recipe"),
+    (Recipe, "in_carts_count", Purchase, "recipe"),
+    (User, "recipes_count", Recipe, "author"),
+    (User, "followers_count", Follow, "author"),
+)
+
+
+def count_of(queryset, field):
+    """Correlated subquery counting rows of ``queryset`` per ``field``"""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(count=Count("pk"))
+            .values("count"),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def recount(using=DEFAULT_DB_ALIAS, check=False):
+    """Repair denormalized counters, return ``(model, field, drifted)``.
+
+    With ``check`` the drifted rows are only counted.
+    """
+    results = []
+    with transaction.atomic(using=using):
+        for model, field, related_model, related_field in COUNTERS:
+            expected = count_of(
+                related_model.objects.using(using), related_field
+            )
+            drifted = (
+                model.objects.using(using)
+                .annotate(expected=expected)
+                .exclude(**{field: F("expected")})
+            )
+            if check:
+                updated = drifted.count()
+            else:
+                drifted = model.objects.using(using).filter(
+                    pk__in=list(drifted.values_list("pk", flat=True))
+                )
+                updated = drifted.update(**{field: expected})
+            results.append((model, field, updated))
+    return results
+
+
+def backfill_counters(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Count favorites, carts, recipes and followers of existing rows.
+
+    Migrations of this project are generated on deploy, so this runs after
+    ``migrate`` instead of as a data migration. Only drifted rows are
+    written, so later runs are cheap.
+    """
+    recount(using)
+
+
+def backfill_shopping_lists(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Build the shopping lists of carts filled before the lists existed"""
+    with transaction.atomic(using=using):
+        ShoppingListItem.objects.using(using).fill_missing()
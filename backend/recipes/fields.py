@@ -0,0 +1,35 @@
+import json
+
+from django.contrib.postgres.fields import JSONField
+from django.db import models
+from django.utils import timezone
+
+
+class PortableJSONField(JSONField):
+    """JSON field that is stored as text on databases other than Postgres"""
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if connection.vendor != "postgresql":
+            return None if value is None else json.dumps(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+
+class CreatedAtField(models.DateTimeField):
+    """Date and time of insertion, like ``auto_now_add``.
+
+    Unlike ``auto_now_add`` or a default, it leaves the rows that exist when
+    the column is added NULL instead of stamping them with the migration
+    time. Set in ``pre_save``, so ``bulk_create`` fills it too.
+    """
+
+    def pre_save(self, model_instance, add):
+        if add and getattr(model_instance, self.attname) is None:
+            value = timezone.now()
+            setattr(model_instance, self.attname, value)
+            return value
+        return super().pre_save(model_instance, add)
@@ -0,0 +1,140 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from io import BytesIO
+from pathlib import PurePosixPath
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+from .models import Recipe
+from .thumbnails import generate_thumbnails, get_thumbnail_format
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+# sent in the web process once a recipe image has been finalized
+image_processed = Signal()
+
+
+def process_image(name):
+    """Downscale and re-encode an oversize image, return its final name"""
+    max_size = settings.RECIPE_IMAGE_MAX_SIZE
+    with default_storage.open(name) as file:
+        image = Image.open(file)
+        if (
+            max(image.size) <= max_size
+            and file.size <= settings.RECIPE_IMAGE_MAX_BYTES
+        ):
+            return name
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size))
+    image_format = get_thumbnail_format()
+    if image.mode not in ("RGB", "RGBA") or image_format == "JPEG":
+        image = image.convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=settings.RECIPE_IMAGE_QUALITY)
+    final_name = PurePosixPath(name).with_suffix(
+        "." + EXTENSIONS[image_format]
+    )
+    return default_storage.save(
+        str(final_name), ContentFile(buffer.getvalue())
+    )
+
+
+def finalize_recipe_image(recipe_id, name):
+    """Process an uploaded image, create its thumbnails, mark it ready.
+
+    The recipe is only updated if it still points at ``name``, so a newer
+    upload is never overwritten by a slower job for an older one.
+    """
+    final_name = process_image(name)
+    thumbnails = generate_thumbnails(final_name)
+    updated = Recipe.objects.filter(pk=recipe_id, image=name).update(
+        image=final_name, image_ready=True, thumbnails=thumbnails
+    )
+    if final_name != name:
+        default_storage.delete(name if updated else final_name)
+
+
+class ImageProcessor:
+    """Bounded pool of worker processes that finalizes uploaded images.
+
+    At most ``IMAGE_PROCESSING_QUEUE_SIZE`` jobs are queued; beyond that, or
+    with no workers configured, the job runs in the calling thread instead.
+    Workers are spawned rather than forked, so they never share database
+    connections with the web process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._slots is None:
+                self._slots = threading.BoundedSemaphore(
+                    settings.IMAGE_PROCESSING_QUEUE_SIZE
+                )
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=django.setup,
+                )
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def submit(self, recipe_id, name):
+        if settings.IMAGE_PROCESSING_WORKERS > 0:
+            executor = self._get_executor()
+            if self._slots.acquire(blocking=False):
+                try:
+                    future = executor.submit(
+                        finalize_recipe_image, recipe_id, name
+                    )
+                except BrokenProcessPool:
+                    self._slots.release()
+                    self._reset(executor)
+                else:
+                    future.add_done_callback(
+                        partial(self._done, recipe_id, executor)
+                    )
+                    return
+        try:
+            finalize_recipe_image(recipe_id, name)
+        except Exception:
+            logger.exception("Failed to process image %s", name)
+        else:
+            image_processed.send(sender=Recipe, recipe_id=recipe_id)
+
+    def _done(self, recipe_id, executor, future):
+        self._slots.release()
+        try:
+            future.result()
+        except BrokenProcessPool:
+            logger.exception("Image worker of recipe %s died", recipe_id)
+            self._reset(executor)
+        except Exception:
+            logger.exception(
+                "Failed to process image of recipe %s", recipe_id
+            )
+        else:
+            image_processed.send(sender=Recipe, recipe_id=recipe_id)
+
+
+image_processor = ImageProcessor()
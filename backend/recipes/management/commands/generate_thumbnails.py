@@ -0,0 +1,97 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from recipes.images import finalize_recipe_image, image_processed
+from recipes.models import Recipe
+from recipes.thumbnails import generate_thumbnails
+
+
+def generate(name):
+    """Worker: create the variants of one image.
+
+    Returns ``(name, thumbnails, error)``, the recipes are updated in the
+    parent process. sorl does not fail for a missing source, it returns
+    names of thumbnails it never wrote, so that is checked first.
+    """
+    if not default_storage.exists(name):
+        return name, None, f"{name}: файл не найден"
+    try:
+        return name, generate_thumbnails(name), None
+    except Exception as error:
+        return name, None, f"{name}: {error}"
+
+
+def finalize(recipe):
+    """Worker: finish an upload whose background job never completed.
+
+    Returns ``(recipe_id, error)``.
+    """
+    recipe_id, name = recipe
+    if not default_storage.exists(name):
+        return recipe_id, f"{name}: файл не найден"
+    try:
+        finalize_recipe_image(recipe_id, name)
+    except Exception as error:
+        return recipe_id, f"{name}: {error}"
+    return recipe_id, None
+
+
+class Command(BaseCommand):
+    help = (
+        "Создаёт недостающие миниатюры изображений рецептов и завершает "
+        "обработку загрузок, которые не были обработаны"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count(),
+            help="Количество параллельных процессов",
+        )
+        parser.add_argument("--chunk-size", type=int, default=16)
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image="").order_by()
+        # a failed job or a restarted worker leaves the upload unprocessed
+        pending = list(
+            recipes.filter(image_ready=False).values_list("id", "image")
+        )
+        names = list(
+            recipes.filter(image_ready=True)
+            .values_list("image", flat=True)
+            .distinct()
+        )
+        # forked workers must not share the parent's database connection
+        connections.close_all()
+        started = time.monotonic()
+        errors = 0
+        with ProcessPoolExecutor(max_workers=options["processes"]) as pool:
+            for recipe_id, error in pool.map(
+                finalize, pending, chunksize=options["chunk_size"]
+            ):
+                if error is not None:
+                    errors += 1
+                    self.stderr.write(error)
+                else:
+                    image_processed.send(sender=Recipe, recipe_id=recipe_id)
+            for name, thumbnails, error in pool.map(
+                generate, names, chunksize=options["chunk_size"]
+            ):
+                if error is not None:
+                    errors += 1
+                    self.stderr.write(error)
+                else:
+                    Recipe.objects.filter(image=name).update(
+                        thumbnails=thumbnails
+                    )
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Изображений обработано: {len(pending) + len(names)}, "
+            f"ошибок: {errors}, {elapsed:.1f} с"
+        )
@@ -0,0 +1,112 @@
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import Ingredient, Tag
+from recipes.signals import rows_loaded
+
+# the repository's data directory, mounted at /data in the backend container
+DATA_DIR = settings.BASE_DIR.parent / "data"
+
+
+def read_rows(path, fields):
+    """Stream rows of a headerless CSV file or a JSON list as dicts"""
+    if path.suffix == ".json":
+        with open(path, encoding="utf-8") as file:
+            yield from json.load(file)
+        return
+    with open(path, encoding="utf-8", newline="") as file:
+        for row in csv.reader(file):
+            if row:
+                yield dict(zip(fields, (value.strip() for value in row)))
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = "Загружает ингредиенты и тэги из CSV или JSON файлов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ingredients",
+            default=DATA_DIR / "ingredients.csv",
+            help="Файл ингредиентов: name,measurement_unit",
+        )
+        parser.add_argument(
+            "--tags",
+            default=DATA_DIR / "tags.csv",
+            help="Файл тэгов: name,slug,color",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только подсчитать новые записи, ничего не сохраняя",
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        self.dry_run = options["dry_run"]
+        try:
+            with transaction.atomic():
+                loaded = {
+                    Ingredient: self.load_ingredients(options["ingredients"]),
+                    Tag: self.load_tags(options["tags"]),
+                }
+        except (OSError, KeyError, ValueError) as error:
+            raise CommandError(f"Не удалось загрузить данные: {error}")
+        for model, created in loaded.items():
+            if created and not self.dry_run:
+                rows_loaded.send(sender=model)
+
+    def load_ingredients(self, path):
+        existing = set(
+            Ingredient.objects.values_list("name", "measurement_unit")
+        )
+        rows = read_rows(Path(path), ("name", "measurement_unit"))
+        return self.load(
+            Ingredient, rows, existing, ("name", "measurement_unit")
+        )
+
+    def load_tags(self, path):
+        existing = set(Tag.objects.values_list("slug"))
+        rows = read_rows(Path(path), ("name", "slug", "color"))
+        return self.load(Tag, rows, existing, ("slug",))
+
+    def load(self, model, rows, existing, key_fields):
+        started = time.monotonic()
+        read = created = 0
+        for batch in batched(rows, self.batch_size):
+            read += len(batch)
+            objects = []
+            for row in batch:
+                key = tuple(row[field] for field in key_fields)
+                if key in existing:
+                    continue
+                existing.add(key)
+                objects.append(model(**row))
+            created += len(objects)
+            if not self.dry_run:
+                model.objects.bulk_create(objects, ignore_conflicts=True)
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{model._meta.verbose_name_plural}: прочитано {read}, "
+                f"{'будет добавлено' if self.dry_run else 'добавлено'} "
+                f"{created}, {read / elapsed:.0f} строк/с"
+            )
+        )
+        return created
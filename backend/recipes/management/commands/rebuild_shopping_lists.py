@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Пересобирает материализованные списки покупок и ищет расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только проверить расхождения, не изменяя данные",
+        )
+
+    def handle(self, *args, **options):
+        expected = {
+            (row["user_id"], row["ingredient_id"]): row["total_amount"]
+            for row in ShoppingListItem.objects.expected_totals().iterator()
+        }
+        if options["check"]:
+            drift = self.find_drift(expected)
+            if drift:
+                raise CommandError(
+                    f"Найдено расхождений: {drift}. "
+                    f"Запустите команду без --check для пересборки."
+                )
+            self.stdout.write(self.style.SUCCESS("Расхождений не найдено"))
+            return
+
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (
+                    ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=total_amount,
+                    )
+                    for (user_id, ingredient_id), total_amount
+                    in expected.items()
+                ),
+                batch_size=BATCH_SIZE,
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"Записано позиций: {len(expected)}")
+        )
+
+    def find_drift(self, expected):
+        actual = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in (
+                ShoppingListItem.objects.values_list(
+                    "user_id", "ingredient_id", "total_amount"
+                ).iterator()
+            )
+        }
+        drift = 0
+        for key in expected.keys() | actual.keys():
+            if expected.get(key) != actual.get(key):
+                drift += 1
+                user_id, ingredient_id = key
+                self.stdout.write(
+                    f"user={user_id} ingredient={ingredient_id}: "
+                    f"ожидается {expected.get(key)}, "
+                    f"в таблице {actual.get(key)}"
+                )
+        return drift
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from recipes.backfill import recount
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает денормализованные счётчики рецептов и авторов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только показать расхождения, не изменяя данные",
+        )
+
+    def handle(self, *args, **options):
+        for model, field, updated in recount(check=options["check"]):
+            self.stdout.write(
+                f"{model._meta.verbose_name_plural}.{field}: "
+                f"расхождений {updated}"
+            )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipes.scores import refresh_scores
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает рейтинги популярности рецептов"
+
+    def handle(self, *args, **options):
+        updated = refresh_scores()
+        self.stdout.write(f"Обновлено рейтингов: {updated}")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from recipes.management.commands.load_data import batched
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает поисковые векторы и списки ингредиентов рецептов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--missing",
+            action="store_true",
+            help="Только рецепты без поискового вектора или списка "
+            "ингредиентов",
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.order_by("pk")
+        if options["missing"]:
+            recipes = recipes.filter(
+                Q(search_vector=None) | Q(ingredient_ids=None)
+            )
+        updated = 0
+        for batch in batched(
+            recipes.values_list("pk", flat=True).iterator(),
+            options["batch_size"],
+        ):
+            batch_recipes = Recipe.objects.filter(pk__in=batch)
+            batch_recipes.update_search_vectors()
+            updated += batch_recipes.update_ingredient_ids()
+        self.stdout.write(f"Обновлено рецептов: {updated}")
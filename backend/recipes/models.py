@@ -1,7 +1,43 @@
 from colorfield.fields import ColorField
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.aggregates import ArrayAgg, StringAgg
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    SearchVectorField,
+    TrigramSimilarity,
+)
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import (
+    BooleanField,
+    Case,
+    Count,
+    DecimalField,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    TextField,
+    Value,
+    When,
+    Window,
+)
+from django.db.models.functions import RowNumber
+
+from .fields import CreatedAtField, PortableJSONField
+from .search import (
+    Cardinality,
+    CountNotIn,
+    PortableArrayField,
+    has_trigram_extension,
+)
 
 User = get_user_model()
 
@@ -46,11 +82,166 @@ class Ingredient(models.Model):
         verbose_name_plural = "ингредиенты"
         indexes = [models.Index(fields=["name"])]
         ordering = ("name",)
+        constraints = [
+            models.UniqueConstraint(
+                fields=["name", "measurement_unit"],
+                name="unique_ingredient_name_unit",
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        """Annotate per-user favorite, cart and subscription flags"""
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+                author_is_subscribed=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+            is_in_shopping_cart=Exists(
+                Purchase.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+            author_is_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef("author"))
+            ),
+        )
+
+    def with_relations(self):
+        """Load author, tags and ingredients needed to render recipes"""
+        return self.select_related("author").prefetch_related(
+            "tags",
+            models.Prefetch(
+                "ingredientsforrecipe",
+                queryset=IngredientForRecipe.objects.select_related(
+                    "ingredient"
+                ),
+            ),
+        )
+
+    def limit_per_author(self, limit):
+        """Keep only the ``limit`` newest recipes of every author"""
+        ranked = (
+            self.order_by()
+            .annotate(
+                row_number=Window(
+                    expression=RowNumber(),
+                    partition_by=[F("author_id")],
+                    order_by=[F("pub_date").desc(), F("id").desc()],
+                )
+            )
+            .values("id", "row_number")
+        )
+        sql, params = ranked.query.sql_with_params()
+        return self.extra(
+            where=[
+                f'"{self.model._meta.db_table}"."id" IN '
+                f'(SELECT "id" FROM ({sql}) AS "ranked" '
+                f'WHERE "row_number" <= %s)'
+            ],
+            params=[*params, limit],
+        )
+
+    def search(self, text):
+        """Full-text matches ranked by relevance.
+
+        With ``pg_trgm`` installed, recipes whose name is merely similar to
+        ``text`` match too, so a typo still finds something.
+        """
+        if connections[self.db].vendor != "postgresql":
+            return self.filter(
+                Q(name__icontains=text) | Q(text__icontains=text)
+            )
+        query = SearchQuery(text, config=settings.RECIPE_SEARCH_CONFIG)
+        condition = Q(search_vector=query)
+        score = SearchRank(F("search_vector"), query)
+        if has_trigram_extension(self.db):
+            condition |= Q(name__trigram_similar=text)
+            score = score + TrigramSimilarity("name", text)
+        return (
+            self.annotate(search_rank=score)
+            .filter(condition)
+            .order_by("-search_rank", "-pub_date", "-id")
+        )
+
+    def update_search_vectors(self):
+        """Recompute the stored search vector of the recipes in the queryset"""
+        if connections[self.db].vendor != "postgresql":
+            return 0
+        config = settings.RECIPE_SEARCH_CONFIG
+        ingredient_names = (
+            IngredientForRecipe.objects.filter(recipe=OuterRef("pk"))
+            .order_by()
+            .values("recipe")
+            .annotate(names=StringAgg("ingredient__name", " "))
+            .values("names")
+        )
+        return self.update(
+            search_vector=(
+                SearchVector("name", weight="A", config=config)
+                + SearchVector(
+                    Subquery(ingredient_names, output_field=TextField()),
+                    weight="B",
+                    config=config,
+                )
+                + SearchVector("text", weight="C", config=config)
+            )
+        )
+
+    def with_ingredient_coverage(self, ingredient_ids):
+        """Recipes using any of ``ingredient_ids``, fewest missing first.
+
+        Annotates ``ingredients_count`` and ``missing_count``. Among recipes
+        missing the same number of ingredients the larger ones come first,
+        which is the same as ordering by the covered share.
+        """
+        ingredient_ids = sorted(set(ingredient_ids))
+        if connections[self.db].vendor != "postgresql":
+            queryset = self.annotate(
+                ingredients_count=Count("ingredientsforrecipe"),
+                missing_count=Count(
+                    "ingredientsforrecipe",
+                    filter=~Q(
+                        ingredientsforrecipe__ingredient__in=ingredient_ids
+                    ),
+                ),
+            ).filter(missing_count__lt=F("ingredients_count"))
+        else:
+            queryset = self.filter(
+                ingredient_ids__overlap=ingredient_ids
+            ).annotate(
+                ingredients_count=Cardinality("ingredient_ids"),
+                missing_count=CountNotIn("ingredient_ids", ingredient_ids),
+            )
+        return queryset.order_by(
+            "missing_count", "-ingredients_count", "-pub_date", "-id"
+        )
+
+    def update_ingredient_ids(self):
+        """Recompute the stored ingredient ids of the queryset's recipes"""
+        if connections[self.db].vendor != "postgresql":
+            return 0
+        ingredient_ids = (
+            IngredientForRecipe.objects.filter(recipe=OuterRef("pk"))
+            .order_by()
+            .values("recipe")
+            .annotate(ids=ArrayAgg("ingredient_id", ordering="ingredient_id"))
+            .values("ids")
+        )
+        return self.update(
+            ingredient_ids=Subquery(
+                ingredient_ids, output_field=ArrayField(IntegerField())
+            )
+        )
+
+
 class Recipe(models.Model):
     """Model for recipes"""
 
@@ -64,6 +255,13 @@ class Recipe(models.Model):
     image = models.ImageField(
         verbose_name="изображение", upload_to="recipe_images/"
     )
+    image_ready = models.BooleanField(
+        verbose_name="изображение обработано", default=True, editable=False
+    )
+    # storage names of the image variants, see recipes.thumbnails
+    thumbnails = PortableJSONField(
+        verbose_name="миниатюры", default=dict, editable=False
+    )
     text = models.TextField(verbose_name="текстовое описание")
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -87,13 +285,39 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         verbose_name="дата создания", auto_now_add=True
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name="в избранном", default=0, editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name="в списках покупок", default=0, editable=False
+    )
+    # refreshed by the refresh_scores command, see recipes.scores
+    popular_score = models.FloatField(
+        verbose_name="популярность", default=0, editable=False
+    )
+    trending_score = models.FloatField(
+        verbose_name="популярность за последние дни",
+        default=0,
+        editable=False,
+    )
+    # GIN index is created in recipes.search after migrate
+    search_vector = SearchVectorField(null=True, editable=False)
+    # sorted ids of the recipe's ingredients, the GIN index over them is
+    # the ingredient -> recipes inverted index used by ingredient search
+    ingredient_ids = PortableArrayField(
+        models.IntegerField(), null=True, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = "рецепт"
         verbose_name_plural = "рецепты"
         indexes = [
             models.Index(fields=["name"]),
-            models.Index(fields=["pub_date"]),
+            models.Index(fields=["pub_date", "id"]),
+            models.Index(fields=["popular_score", "id"]),
+            models.Index(fields=["trending_score", "id"]),
         ]
         constraints = [
             models.UniqueConstraint(
@@ -106,6 +330,96 @@ class Recipe(models.Model):
         return self.name
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    """Recipes a user keeps in a list, changed in bulk.
+
+    ``bulk_create`` sends no signals, so the ``counter`` of recipes and
+    other side effects of adding are applied explicitly.
+    """
+
+    counter = None
+
+    @staticmethod
+    def lock_recipes(recipe_ids):
+        """Hold back other additions of these recipes until commit.
+
+        Inserting a favorite or a purchase takes a key share lock on its
+        recipe, which conflicts with ``FOR UPDATE``. A presence check made
+        after this call therefore stays true until the side effects of the
+        additions are applied.
+        """
+        list(
+            Recipe.objects.select_for_update()
+            .filter(id__in=recipe_ids)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+    def get_presence(self, user, recipe_ids):
+        """``{recipe_id: in the user's list}`` of existing recipes"""
+        return dict(
+            Recipe.objects.filter(id__in=recipe_ids)
+            .annotate(
+                present=Exists(
+                    self.model.objects.filter(
+                        user=user, recipe=OuterRef("pk")
+                    )
+                )
+            )
+            .order_by()
+            .values_list("id", "present")
+        )
+
+    @staticmethod
+    def get_statuses(recipe_ids, presence, present, absent):
+        return {
+            pk: (present if presence[pk] else absent)
+            if pk in presence
+            else "not_found"
+            for pk in recipe_ids
+        }
+
+    def add_recipes(self, user, recipe_ids):
+        """Add recipes to the user's list, return their statuses"""
+        recipe_ids = list(dict.fromkeys(recipe_ids))
+        with transaction.atomic():
+            self.lock_recipes(recipe_ids)
+            presence = self.get_presence(user, recipe_ids)
+            added = [pk for pk in recipe_ids if presence.get(pk) is False]
+            self.bulk_create(
+                [self.model(user=user, recipe_id=pk) for pk in added],
+                ignore_conflicts=True,
+            )
+            Recipe.objects.filter(id__in=added).update(
+                **{self.counter: F(self.counter) + 1}
+            )
+            self.recipes_added(user, added)
+        return self.get_statuses(recipe_ids, presence, "exists", "added")
+
+    def remove_recipes(self, user, recipe_ids):
+        """Remove recipes from the user's list, return their statuses"""
+        recipe_ids = list(dict.fromkeys(recipe_ids))
+        with transaction.atomic():
+            presence = self.get_presence(user, recipe_ids)
+            # deletion still sends signals, which update the counters
+            self.filter(user=user, recipe_id__in=recipe_ids).delete()
+        return self.get_statuses(recipe_ids, presence, "removed", "absent")
+
+    def recipes_added(self, user, recipe_ids):
+        pass
+
+
+class FavoriteQuerySet(UserRecipeQuerySet):
+    counter = "favorites_count"
+
+
+class PurchaseQuerySet(UserRecipeQuerySet):
+    counter = "in_carts_count"
+
+    def recipes_added(self, user, recipe_ids):
+        ShoppingListItem.objects.add_recipes([user.pk], recipe_ids)
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         User,
@@ -119,6 +433,14 @@ class Favorite(models.Model):
         verbose_name="Избранный рецепт",
         related_name="favorites",
     )
+    # NULL for favorites added before the date was recorded
+    date_added = CreatedAtField(
+        null=True,
+        editable=False,
+        verbose_name="Дата добавления",
+    )
+
+    objects = FavoriteQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Избранный"
@@ -218,6 +540,8 @@ class Purchase(models.Model):
         verbose_name="Дата добавления",
     )
 
+    objects = PurchaseQuerySet.as_manager()
+
     class Meta:
         ordering = ("-date_added",)
         verbose_name = "Покупка"
@@ -230,3 +554,148 @@ class Purchase(models.Model):
 
     def __str__(self):
         return f"Рецепт {self.recipe} в списке покупок у {self.user}"
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    def add_amounts(self, user_ids, amounts):
+        """Add ``{ingredient_id: amount}`` to the lists of given users"""
+        amounts = {key: value for key, value in amounts.items() if value}
+        user_ids = list(user_ids)
+        if not amounts or not user_ids:
+            return
+        with transaction.atomic():
+            self._add_amounts(user_ids, amounts)
+
+    def _add_amounts(self, user_ids, amounts):
+        self.bulk_create(
+            [
+                self.model(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    total_amount=0,
+                )
+                for user_id in user_ids
+                for ingredient_id in amounts
+            ],
+            ignore_conflicts=True,
+        )
+        items = self.filter(user_id__in=user_ids, ingredient_id__in=amounts)
+        items.update(
+            total_amount=F("total_amount")
+            + Case(
+                *(
+                    When(ingredient_id=ingredient_id, then=Value(amount))
+                    for ingredient_id, amount in amounts.items()
+                ),
+                default=Value(0),
+                output_field=DecimalField(max_digits=10, decimal_places=1),
+            )
+        )
+        items.filter(total_amount__lte=0).delete()
+
+    def add_recipes(self, user_ids, recipe_ids, sign=1):
+        if not recipe_ids:
+            return
+        amounts = (
+            IngredientForRecipe.objects.filter(recipe_id__in=recipe_ids)
+            .values("ingredient_id")
+            .annotate(total=Sum("amount"))
+            .order_by()
+            .values_list("ingredient_id", "total")
+        )
+        self.add_amounts(
+            user_ids,
+            {
+                ingredient_id: sign * amount
+                for ingredient_id, amount in amounts
+            },
+        )
+
+    def add_recipe(self, user_ids, recipe_id, sign=1):
+        self.add_recipes(user_ids, [recipe_id], sign)
+
+    def remove_recipe(self, user_ids, recipe_id):
+        self.add_recipe(user_ids, recipe_id, sign=-1)
+
+    def update_recipe(self, recipe_id, old_amounts, new_amounts):
+        """Apply a change of recipe ingredients to every cart holding it"""
+        deltas = {
+            ingredient_id: new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0)
+            for ingredient_id in {*old_amounts, *new_amounts}
+        }
+        user_ids = Purchase.objects.filter(recipe_id=recipe_id).values_list(
+            "user_id", flat=True
+        )
+        self.add_amounts(user_ids, deltas)
+
+    def expected_totals(self, user_ids=None):
+        """Shopping list totals recomputed from scratch out of purchases"""
+        if user_ids is None:
+            purchased = {"recipe__recipes_to_purchase__isnull": False}
+        else:
+            purchased = {"recipe__recipes_to_purchase__user_id__in": user_ids}
+        return (
+            IngredientForRecipe.objects.using(self.db)
+            .filter(**purchased)
+            .values(
+                "ingredient_id",
+                user_id=F("recipe__recipes_to_purchase__user_id"),
+            )
+            .annotate(total_amount=Sum("amount"))
+            .order_by()
+        )
+
+    def fill_missing(self):
+        """Build the lists of users who have purchases but no items"""
+        user_ids = (
+            Purchase.objects.using(self.db)
+            .exclude(user_id__in=self.values("user_id"))
+            .values("user_id")
+        )
+        return len(
+            self.bulk_create(
+                (
+                    self.model(**row)
+                    for row in self.expected_totals(user_ids).iterator()
+                ),
+                batch_size=1000,
+            )
+        )
+
+
+class ShoppingListItem(models.Model):
+    """Materialized shopping list totals of a user"""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="покупатель",
+        related_name="shopping_list",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name="ингредиент",
+        related_name="shopping_list_items",
+    )
+    total_amount = models.DecimalField(
+        verbose_name="общее количество",
+        max_digits=10,
+        decimal_places=1,
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Позиция списка покупок"
+        verbose_name_plural = "Позиции списка покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_shopping_list_user_ingredient",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.ingredient} в списке покупок у {self.user}"
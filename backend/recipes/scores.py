@@ -0,0 +1,130 @@
+from collections import defaultdict
+from datetime import timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from .models import Favorite, Purchase, Recipe
+
+# older events add less than 2 ** -30 of a fresh one and are skipped
+MAX_HALF_LIVES = 30
+
+REFRESH_SQL = """
+WITH events AS (
+    SELECT
+        favorite.recipe_id,
+        COALESCE(favorite.date_added, recipe.pub_date) AS date_added,
+        favorite.date_added IS NOT NULL AS dated
+    FROM {favorite} AS favorite
+    JOIN {recipe} AS recipe ON recipe.id = favorite.recipe_id
+    UNION ALL
+    SELECT recipe_id, date_added, TRUE FROM {purchase}
+), scores AS (
+    SELECT
+        recipe_id,
+        SUM(power(0.5, EXTRACT(EPOCH FROM %(now)s - date_added)::float8
+            / %(popular_half_life)s))
+            FILTER (WHERE date_added > %(popular_since)s) AS popular,
+        SUM(power(0.5, EXTRACT(EPOCH FROM %(now)s - date_added)::float8
+            / %(trending_half_life)s))
+            FILTER (WHERE date_added > %(trending_since)s AND dated)
+            AS trending
+    FROM events
+    WHERE date_added > %(since)s
+    GROUP BY recipe_id
+)
+UPDATE {recipe} AS recipe
+SET popular_score = COALESCE(scores.popular, 0),
+    trending_score = COALESCE(scores.trending, 0)
+FROM {recipe} AS target
+LEFT JOIN scores ON scores.recipe_id = target.id
+WHERE recipe.id = target.id
+  AND (recipe.popular_score, recipe.trending_score) IS DISTINCT FROM
+      (COALESCE(scores.popular, 0), COALESCE(scores.trending, 0))
+"""
+
+
+def get_half_lives():
+    day = timedelta(days=1).total_seconds()
+    return (
+        settings.RECIPE_POPULAR_HALF_LIFE_DAYS * day,
+        settings.RECIPE_TRENDING_HALF_LIFE_DAYS * day,
+    )
+
+
+def refresh_scores(now=None, using=DEFAULT_DB_ALIAS):
+    """Recompute time-decayed popularity scores of all recipes.
+
+    Every favorite and purchase counts as ``0.5 ** (age / half-life)``,
+    with a long half-life for ``popular_score`` and a short one for
+    ``trending_score``. Favorites added before their date was recorded are
+    aged from the recipe's publication and left out of ``trending_score``.
+    Returns the number of recipes whose scores changed.
+    """
+    now = now or timezone.now()
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return refresh_scores_in_python(now, using)
+    popular, trending = get_half_lives()
+    popular_since = now - timedelta(seconds=popular * MAX_HALF_LIVES)
+    trending_since = now - timedelta(seconds=trending * MAX_HALF_LIVES)
+    sql = REFRESH_SQL.format(
+        favorite=connection.ops.quote_name(Favorite._meta.db_table),
+        purchase=connection.ops.quote_name(Purchase._meta.db_table),
+        recipe=connection.ops.quote_name(Recipe._meta.db_table),
+    )
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(
+            sql,
+            {
+                "now": now,
+                "popular_half_life": popular,
+                "trending_half_life": trending,
+                "popular_since": popular_since,
+                "trending_since": trending_since,
+                "since": min(popular_since, trending_since),
+            },
+        )
+        return cursor.rowcount
+
+
+def refresh_scores_in_python(now, using):
+    """Same scores for databases used in development, such as SQLite"""
+    half_lives = get_half_lives()
+    scores = defaultdict(lambda: [0.0, 0.0])
+    favorites = Favorite.objects.using(using).values_list(
+        "recipe_id", "date_added", "recipe__pub_date"
+    )
+    purchases = Purchase.objects.using(using).values_list(
+        "recipe_id", "date_added", "date_added"
+    )
+    for recipe_id, date_added, published in chain(
+        favorites.iterator(), purchases.iterator()
+    ):
+        dates = (date_added or published, date_added)
+        for index, (half_life, date) in enumerate(zip(half_lives, dates)):
+            if date is None:
+                continue
+            age = (now - date).total_seconds()
+            if age < half_life * MAX_HALF_LIVES:
+                scores[recipe_id][index] += 0.5 ** (age / half_life)
+    changed = []
+    recipes = Recipe.objects.using(using).only(
+        "id", "popular_score", "trending_score"
+    )
+    for recipe in recipes.iterator():
+        popular, trending = scores.get(recipe.id, (0, 0))
+        if (recipe.popular_score, recipe.trending_score) != (
+            popular,
+            trending,
+        ):
+            recipe.popular_score = popular
+            recipe.trending_score = trending
+            changed.append(recipe)
+    with transaction.atomic(using=using):
+        Recipe.objects.using(using).bulk_update(
+            changed, ["popular_score", "trending_score"], batch_size=500
+        )
+    return len(changed)
@@ -0,0 +1,87 @@
+import logging
+from functools import lru_cache
+
+from django.contrib.postgres.fields import ArrayField
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models import Func, IntegerField
+
+logger = logging.getLogger(__name__)
+
+
+class PortableArrayField(ArrayField):
+    """Array field that can still be saved as NULL on other databases"""
+
+    def get_placeholder(self, value, compiler, connection):
+        if connection.vendor != "postgresql":
+            return "%s"
+        return super().get_placeholder(value, compiler, connection)
+
+
+class Cardinality(Func):
+    function = "CARDINALITY"
+    output_field = IntegerField()
+
+
+class CountNotIn(Func):
+    """Number of elements of an array expression missing from ``values``"""
+
+    template = (
+        "(SELECT count(*) FROM unnest(%(expressions)s) AS item "
+        "WHERE item <> ALL(%(values)s))"
+    )
+    output_field = IntegerField()
+
+    def __init__(self, expression, values, **extra):
+        super().__init__(expression, **extra)
+        self.values = list(values)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super().as_sql(
+            compiler, connection, values="%s", **extra_context
+        )
+        return sql, [*params, self.values]
+
+
+@lru_cache(maxsize=None)
+def has_trigram_extension(using):
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_search_indexes(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Create the PostgreSQL-only search indexes after ``migrate``.
+
+    They are kept out of ``Meta.indexes`` so that the models still migrate
+    on SQLite. ``pg_trgm`` is optional: without it search does not fall
+    back to trigram similarity.
+    """
+    from .models import Recipe
+
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return
+    table = connection.ops.quote_name(Recipe._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_gin "
+            f"ON {table} USING gin (search_vector)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS recipes_recipe_ingredient_ids_gin "
+            f"ON {table} USING gin (ingredient_ids)"
+        )
+        try:
+            with transaction.atomic(using=using):
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except DatabaseError as error:
+            logger.warning("pg_trgm is not available: %s", error)
+        else:
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS recipes_recipe_name_trgm "
+                f"ON {table} USING gin (name gin_trgm_ops)"
+            )
+    has_trigram_extension.cache_clear()
@@ -0,0 +1,141 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from .autocomplete import ingredient_index
+from .images import image_processor
+from .models import (
+    Favorite,
+    Follow,
+    Ingredient,
+    IngredientForRecipe,
+    Purchase,
+    Recipe,
+    ShoppingListItem,
+)
+
+User = get_user_model()
+
+# sent by load_data for each model it bulk-created rows of, since
+# bulk_create sends no post_save
+rows_loaded = Signal()
+
+
+def change_counter(model, pk, field, delta):
+    # never below zero, even for rows counted before the counter existed
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+@receiver(post_save, sender=Purchase)
+def add_purchase_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.add_recipe(
+            [instance.user_id], instance.recipe_id
+        )
+
+
+@receiver(pre_delete, sender=Purchase)
+def remove_purchase_from_shopping_list(sender, instance, **kwargs):
+    ShoppingListItem.objects.remove_recipe(
+        [instance.user_id], instance.recipe_id
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Favorite)
+def increment_favorites_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, "favorites_count", 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def decrement_favorites_count(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, "favorites_count", -1)
+
+
+@receiver(post_save, sender=Purchase)
+def increment_in_carts_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, "in_carts_count", 1)
+
+
+@receiver(post_delete, sender=Purchase)
+def decrement_in_carts_count(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, "in_carts_count", -1)
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, "recipes_count", 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    change_counter(User, instance.author_id, "recipes_count", -1)
+
+
+@receiver(post_save, sender=Follow)
+def increment_followers_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, "followers_count", 1)
+
+
+@receiver(post_delete, sender=Follow)
+def decrement_followers_count(sender, instance, **kwargs):
+    change_counter(User, instance.author_id, "followers_count", -1)
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(sender, instance, **kwargs):
+    if instance.image and not instance.image_ready:
+        recipe_id, name = instance.pk, instance.image.name
+        transaction.on_commit(
+            lambda: image_processor.submit(recipe_id, name)
+        )
+
+
+def update_search_vectors_on_commit(recipes):
+    transaction.on_commit(recipes.update_search_vectors)
+
+
+def update_recipe_indexes_on_commit(recipes):
+    def update():
+        recipes.update_search_vectors()
+        recipes.update_ingredient_ids()
+
+    transaction.on_commit(update)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_indexes(sender, instance, **kwargs):
+    # also covers ingredients bulk-created by AddRecipeSerializer, which
+    # saves the recipe in the same transaction
+    update_recipe_indexes_on_commit(Recipe.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=IngredientForRecipe)
+@receiver(post_delete, sender=IngredientForRecipe)
+def update_recipe_ingredient_indexes(sender, instance, **kwargs):
+    update_recipe_indexes_on_commit(
+        Recipe.objects.filter(pk=instance.recipe_id)
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes_search_vectors(sender, instance, created,
+                                             **kwargs):
+    if not created:
+        update_search_vectors_on_commit(
+            Recipe.objects.filter(ingredients=instance)
+        )
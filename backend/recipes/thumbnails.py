@@ -0,0 +1,35 @@
+from django.conf import settings
+from PIL import features
+from sorl.thumbnail import default, get_thumbnail
+
+
+def get_thumbnail_format():
+    """Configured format, falling back to JPEG without WebP support"""
+    thumbnail_format = settings.RECIPE_THUMBNAIL_FORMAT
+    if thumbnail_format == "WEBP" and not features.check("webp"):
+        return "JPEG"
+    return thumbnail_format
+
+
+def generate_thumbnails(image):
+    """Return storage names of every configured variant of ``image``.
+
+    Missing variants are created. Existing ones are found in the sorl
+    key-value store, so calling this for an image that has already been
+    processed does not touch the file. The names are kept in
+    ``Recipe.thumbnails``, so serializers never call sorl.
+    """
+    thumbnail_format = get_thumbnail_format()
+    return {
+        name: get_thumbnail(
+            image, geometry, format=thumbnail_format, **options
+        ).name
+        for name, (geometry, options) in settings.RECIPE_THUMBNAILS.items()
+    }
+
+
+def get_thumbnail_urls(thumbnails):
+    """URLs of thumbnail names stored on a recipe"""
+    return {
+        name: default.storage.url(path) for name, path in thumbnails.items()
+    }
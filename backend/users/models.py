@@ -7,5 +7,11 @@ class User(AbstractUser):
     first_name = models.CharField(_("first name"), max_length=150)
     last_name = models.CharField(_("last name"), max_length=150)
     email = models.EmailField(_("email"), max_length=254, unique=True)
+    recipes_count = models.PositiveIntegerField(
+        "количество рецептов", default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        "количество подписчиков", default=0, editable=False
+    )
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ("username", "first_name", "last_name")
@@ -0,0 +1,99 @@
+from datetime import timedelta
+
+import pytest
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, IngredientForRecipe, Recipe, Tag
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # cached versions, fragments and feeds must not leak between tests
+    for cache in caches.all():
+        cache.clear()
+    yield
+
+
+@pytest.fixture
+def user(django_user_model):
+    return django_user_model.objects.create_user(
+        username="user",
+        email="user@example.com",
+        password="password",
+        first_name="Имя",
+        last_name="Фамилия",
+    )
+
+
+@pytest.fixture
+def make_author(django_user_model):
+    def make_author(username):
+        return django_user_model.objects.create_user(
+            username=username,
+            email=f"{username}@example.com",
+            password="password",
+            first_name=username,
+            last_name=username,
+        )
+
+    return make_author
+
+
+@pytest.fixture
+def user_client(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+@pytest.fixture
+def ingredients():
+    return [
+        Ingredient.objects.create(
+            name=f"ингредиент {index}", measurement_unit="г"
+        )
+        for index in range(3)
+    ]
+
+
+@pytest.fixture
+def tag():
+    return Tag.objects.create(
+        name="Завтрак", slug="breakfast", color="#E26C2D"
+    )
+
+
+@pytest.fixture
+def make_recipes(ingredients, tag):
+    """Create recipes published ``minutes_apart``, with some equal dates"""
+
+    def make_recipes(author, count, minutes_apart=1, published=None):
+        if published is None:
+            published = timezone.now() - timedelta(days=1)
+        start = author.written_recipes.count()
+        recipes = []
+        for index in range(count):
+            recipe = Recipe.objects.create(
+                author=author,
+                name=f"{author.username} {start + index}",
+                text="Описание",
+                cooking_time=10,
+            )
+            recipe.tags.add(tag)
+            for position, ingredient in enumerate(ingredients):
+                IngredientForRecipe.objects.create(
+                    recipe=recipe,
+                    ingredient=ingredient,
+                    amount=index + position + 1,
+                )
+            # pairs of recipes share a date, the id has to break the tie
+            Recipe.objects.filter(pk=recipe.pk).update(
+                pub_date=published
+                + timedelta(minutes=minutes_apart * (index // 2))
+            )
+            recipes.append(recipe)
+        return recipes
+
+    return make_recipes
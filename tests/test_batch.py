@@ -0,0 +1,127 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from recipes.backfill import recount
+from recipes.models import Favorite, Purchase, Recipe, ShoppingListItem
+
+
+def assert_consistent():
+    """Counters and shopping lists match the rows they summarize"""
+    assert [
+        (model._meta.model_name, field, drifted)
+        for model, field, drifted in recount(check=True)
+        if drifted
+    ] == []
+    # raises CommandError when a shopping list drifted from the cart
+    call_command("rebuild_shopping_lists", "--check", stdout=StringIO())
+
+
+def batch(client, method, url, recipes):
+    response = getattr(client, method)(
+        url, {"recipes": [recipe.pk for recipe in recipes]}, format="json"
+    )
+    assert response.status_code == 200, response.content
+    return {item["id"]: item["status"] for item in response.json()}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "url, model",
+    [
+        ("/api/recipes/favorite/batch/", Favorite),
+        ("/api/recipes/shopping_cart/batch/", Purchase),
+    ],
+)
+def test_batch_add_and_remove(user, user_client, make_author, make_recipes,
+                              url, model):
+    recipes = make_recipes(make_author("author"), 5)
+    model.objects.create(user=user, recipe=recipes[0])
+
+    statuses = batch(user_client, "post", url, recipes[:3])
+
+    assert statuses == {
+        recipes[0].pk: "exists",
+        recipes[1].pk: "added",
+        recipes[2].pk: "added",
+    }
+    assert set(
+        model.objects.filter(user=user).values_list("recipe_id", flat=True)
+    ) == {recipe.pk for recipe in recipes[:3]}
+    assert_consistent()
+
+    statuses = batch(user_client, "delete", url, recipes[1:4])
+
+    assert statuses == {
+        recipes[1].pk: "removed",
+        recipes[2].pk: "removed",
+        recipes[3].pk: "absent",
+    }
+    assert list(
+        model.objects.filter(user=user).values_list("recipe_id", flat=True)
+    ) == [recipes[0].pk]
+    assert_consistent()
+
+
+@pytest.mark.django_db
+def test_batch_and_single_endpoints_agree(user, user_client, make_author,
+                                          make_recipes):
+    recipes = make_recipes(make_author("author"), 4)
+    url = "/api/recipes/shopping_cart/batch/"
+
+    response = user_client.get(f"/api/recipes/{recipes[0].pk}/shopping_cart/")
+    assert response.status_code == 201
+    batch(user_client, "post", url, recipes)
+    response = user_client.delete(
+        f"/api/recipes/{recipes[1].pk}/shopping_cart/"
+    )
+    assert response.status_code == 204
+    batch(user_client, "post", url, recipes[:2])
+    batch(user_client, "delete", url, recipes[2:])
+
+    assert Recipe.objects.filter(in_carts_count=1).count() == 2
+    assert ShoppingListItem.objects.filter(user=user).exists()
+    assert_consistent()
+
+
+@pytest.mark.django_db
+def test_unknown_recipes_are_reported(user_client, make_author, make_recipes):
+    recipe, = make_recipes(make_author("author"), 1)
+    missing = Recipe(pk=recipe.pk + 100)
+
+    statuses = batch(
+        user_client, "post", "/api/recipes/favorite/batch/", [recipe, missing]
+    )
+
+    assert statuses[recipe.pk] == "added"
+    assert statuses[missing.pk] == "not_found"
+    assert_consistent()
+
+
+@pytest.mark.django_db
+def test_recipe_update_keeps_shopping_lists(user, user_client, make_author,
+                                            make_recipes, ingredients):
+    author = make_author("author")
+    recipe, other = make_recipes(author, 2)
+    batch(
+        user_client, "post", "/api/recipes/shopping_cart/batch/",
+        [recipe, other],
+    )
+    user_client.force_authenticate(author)
+
+    response = user_client.patch(
+        f"/api/recipes/{recipe.pk}/",
+        {
+            "cooking_time": 5,
+            "ingredients": [
+                {"id": ingredients[0].pk, "amount": 7},
+                {"id": ingredients[2].pk, "amount": 3},
+                {"id": ingredients[2].pk, "amount": 2},
+            ],
+        },
+        format="json",
+    )
+
+    assert response.status_code == 200, response.content
+    assert_consistent()
@@ -0,0 +1,84 @@
+import pytest
+from django.utils import timezone
+
+from recipes.models import Follow, Recipe
+
+
+def walk(client, url):
+    """Ids of every page reached by following ``next`` links"""
+    ids = []
+    total = Recipe.objects.count()
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200, response.content
+        data = response.json()
+        ids.extend(recipe["id"] for recipe in data["results"])
+        # a cursor that does not advance would loop forever
+        assert len(ids) <= total
+        url = data["next"]
+    return ids
+
+
+def newest_first(recipes):
+    return list(
+        recipes.order_by("-pub_date", "-id").values_list("id", flat=True)
+    )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("limit", [1, 3, 4, 100])
+def test_list_cursor_walk(user_client, make_author, make_recipes, limit):
+    make_recipes(make_author("first"), 7)
+    make_recipes(make_author("second"), 6, minutes_apart=2)
+
+    ids = walk(user_client, f"/api/recipes/?cursor=&limit={limit}")
+
+    assert ids == newest_first(Recipe.objects.all())
+
+
+@pytest.mark.django_db
+def test_filtered_list_cursor_walk(user_client, make_author, make_recipes):
+    author = make_author("first")
+    make_recipes(author, 7)
+    make_recipes(make_author("second"), 6)
+
+    ids = walk(
+        user_client, f"/api/recipes/?author={author.pk}&cursor=&limit=2"
+    )
+
+    assert ids == newest_first(Recipe.objects.filter(author=author))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("limit", [1, 2, 5, 100])
+def test_feed_cursor_walk(settings, user, user_client, make_author,
+                          make_recipes, limit):
+    # fewer cached recipes per author than some authors have, so pages
+    # also read the truncated authors from the database
+    settings.FEED_AUTHOR_RECIPES = 3
+    authors = [make_author(f"author{index}") for index in range(3)]
+    make_recipes(authors[0], 8)
+    make_recipes(authors[1], 2, minutes_apart=3)
+    make_recipes(authors[2], 5, minutes_apart=2)
+    make_recipes(make_author("unfollowed"), 4)
+    for author in authors:
+        Follow.objects.create(user=user, author=author)
+
+    ids = walk(user_client, f"/api/recipes/feed/?limit={limit}")
+
+    assert ids == newest_first(Recipe.objects.filter(author__in=authors))
+
+
+# the feed cache is invalidated on commit
+@pytest.mark.django_db(transaction=True)
+def test_feed_follows_new_recipes(user, user_client, make_author,
+                                  make_recipes):
+    author = make_author("author")
+    make_recipes(author, 2)
+    Follow.objects.create(user=user, author=author)
+    walk(user_client, "/api/recipes/feed/")
+
+    make_recipes(author, 3, published=timezone.now())
+
+    ids = walk(user_client, "/api/recipes/feed/?limit=2")
+    assert ids == newest_first(Recipe.objects.filter(author=author))